@@ -0,0 +1,74 @@
+# coding=utf-8
+"""
+Micro-benchmark of the Kasa XOR codec against the original byte-at-a-time implementation.
+
+Run from the repository root:
+	python extras/benchmarks/cipher_benchmark.py
+"""
+from __future__ import absolute_import, print_function
+
+import json
+import os
+import sys
+import timeit
+
+from struct import pack
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "octoprint_tplinksmartplug"))
+
+import protocol
+
+
+def legacy_encrypt(string):
+	key = 171
+	# the original single byte length header breaks above 255 bytes, use a proper one so the loop can be timed
+	result = pack('>I', len(string))
+	for i in bytes(string.encode('latin-1')):
+		a = key ^ i
+		key = a
+		result += bytes([a])
+	return result
+
+
+def legacy_decrypt(string):
+	key = 171
+	result = b""
+	for i in bytes(string):
+		a = key ^ i
+		key = i
+		result += bytes([a])
+	return result.decode('latin-1')
+
+
+def sysinfo_payload(children):
+	sysinfo = {"sw_ver": "1.0.12 Build 200408 Rel.095920", "hw_ver": "2.0", "model": "HS300(US)",
+			   "deviceId": "8006" * 10, "oemId": "5C9E" * 8, "hwId": "34C4" * 8, "rssi": -52,
+			   "latitude_i": 0, "longitude_i": 0, "alias": "Power Strip", "mic_type": "IOT.SMARTPLUGSWITCH",
+			   "feature": "TIM:ENE", "mac": "AA:BB:CC:DD:EE:FF", "updating": 0, "led_off": 0, "err_code": 0,
+			   "children": [{"id": "8006" * 10 + "%02d" % i, "state": 1, "alias": "Outlet %s" % i, "on_time": 3600,
+							 "next_action": {"type": -1}} for i in range(children)],
+			   "child_num": children}
+	emeter = {"voltage_mv": 121530, "current_ma": 1422, "power_mw": 171423, "total_wh": 84221, "err_code": 0}
+	return json.dumps({"system": {"get_sysinfo": sysinfo}, "emeter": {"get_realtime": emeter}})
+
+
+def main():
+	payloads = [("get_sysinfo request", json.dumps({"system": {"get_sysinfo": {}}}))]
+	payloads += [("HS300 sysinfo, %s children" % n, sysinfo_payload(n)) for n in (1, 6)]
+	payloads += [("HS300 sysinfo x8", sysinfo_payload(6) * 8)]
+	print("fast codec available: %s" % protocol._fast_codec)
+	print("%-28s %8s %14s %14s %14s %14s" % ("payload", "bytes", "legacy enc us", "new enc us", "legacy dec us", "new dec us"))
+	for name, payload in payloads:
+		number = 200
+		encrypted = protocol.encrypt(payload)[4:]
+		assert protocol.decrypt(encrypted) == payload
+		timings = [timeit.timeit(func, number=number) / number * 1e6 for func in (
+			lambda: legacy_encrypt(payload),
+			lambda: protocol.encrypt(payload),
+			lambda: legacy_decrypt(encrypted),
+			lambda: protocol.decrypt(encrypted))]
+		print("%-28s %8d %14.1f %14.1f %14.1f %14.1f" % tuple([name, len(payload)] + timings))
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,292 @@
+# coding=utf-8
+"""
+Local emulator of Kasa smart plugs speaking the XOR framed TCP protocol on port 9999.
+
+Emulates HS100 plugs, HS110 and KP115 plugs with energy monitoring (old and
+new emeter units) and HS300 strips with six children addressed through
+``context.child_ids``. Faults can be injected per device: response latency,
+responses split into small TCP segments, dropped connections and hung
+sockets that never answer. Devices answer unframed requests on UDP too.
+
+Run a single device from the repository root, for example:
+	python extras/benchmarks/kasa_emulator.py --model HS300 --host 127.0.0.2 --latency 0.05
+"""
+from __future__ import absolute_import, print_function
+
+import argparse
+import json
+import os
+import random
+import socket
+import sys
+import threading
+import time
+
+from struct import unpack
+
+try:
+	import socketserver
+except ImportError:
+	import SocketServer as socketserver
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "octoprint_tplinksmartplug"))
+
+import protocol
+
+MODELS = {
+	"HS100": dict(feature="TIM", emeter=None, children=0, hw_ver="2.0", sw_ver="1.5.6 Build 191125 Rel.083657"),
+	"HS110": dict(feature="TIM:ENE", emeter="v1", children=0, hw_ver="1.0", sw_ver="1.2.6 Build 200727 Rel.121701"),
+	"KP115": dict(feature="TIM:ENE", emeter="v2", children=0, hw_ver="1.0", sw_ver="1.0.16 Build 210205 Rel.163735"),
+	"HS300": dict(feature="TIM:ENE", emeter="v2", children=6, hw_ver="1.0", sw_ver="1.0.12 Build 200408 Rel.095920"),
+}
+
+
+class EmulatedDevice(object):
+	"""
+	State of one emulated device, ``handle`` answers a decoded request dict like the real firmware.
+	"""
+
+	def __init__(self, model="HS110", mac=None, base_power=120.0):
+		self.model = model
+		self.profile = MODELS[model]
+		self.mac = mac or ":".join("%02X" % random.randint(0, 255) for _ in range(6))
+		self.device_id = self.mac.replace(":", "") * 5
+		self.base_power = base_power
+		self.started = time.time()
+		self._lock = threading.Lock()
+		outlets = self.profile["children"] or 1
+		self.relay_state = [1] * outlets
+		self.on_since = [time.time()] * outlets
+		self.total_offset = [random.uniform(0, 50) for _ in range(outlets)]
+		self.countdown_rules = []
+
+	def child_id(self, index):
+		return "%s%02d" % (self.device_id, index)
+
+	def handle(self, request):
+		children = self._children(request.get("context"))
+		response = {}
+		for module, methods in request.items():
+			if module == "context":
+				continue
+			handler = getattr(self, "_%s" % module, None)
+			if handler is None or not isinstance(methods, dict):
+				response[module] = {"err_code": -1, "err_msg": "module not support"}
+				continue
+			response[module] = {}
+			for method, params in methods.items():
+				result = handler(method, params or {}, children)
+				if result is None:
+					result = {"err_code": -2, "err_msg": "member not support"}
+				response[module][method] = result
+		return response
+
+	def _children(self, context):
+		if not self.profile["children"]:
+			return [0]
+		if not context:
+			return list(range(self.profile["children"]))
+		ids = [self.child_id(i) for i in range(self.profile["children"])]
+		return [ids.index(child) for child in context.get("child_ids", []) if child in ids]
+
+	def _system(self, method, params, children):
+		with self._lock:
+			if method == "get_sysinfo":
+				return self._sysinfo()
+			if method == "set_relay_state":
+				for index in children:
+					if self.relay_state[index] != params.get("state"):
+						self.on_since[index] = time.time()
+					self.relay_state[index] = 1 if params.get("state") else 0
+				return {"err_code": 0}
+
+	def _emeter(self, method, params, children):
+		if method != "get_realtime" or not self.profile["emeter"]:
+			return None
+		# like the firmware only the first child of the context is reported
+		index = children[0] if children else 0
+		with self._lock:
+			on = self.relay_state[index]
+		voltage = 120.0 + random.uniform(-1.5, 1.5)
+		power = (self.base_power + random.uniform(-5, 5)) if on else 0.0
+		current = power / voltage
+		total = self.total_offset[index] + (time.time() - self.started) * self.base_power / 3600000.0
+		if self.profile["emeter"] == "v1":
+			return {"voltage": voltage, "current": current, "power": power, "total": total, "err_code": 0}
+		return {"voltage_mv": int(voltage * 1000), "current_ma": int(current * 1000), "power_mw": int(power * 1000),
+				"total_wh": int(total * 1000), "err_code": 0}
+
+	def _count_down(self, method, params, children):
+		with self._lock:
+			if method == "delete_all_rules":
+				self.countdown_rules = []
+				return {"err_code": 0}
+			if method == "add_rule":
+				self.countdown_rules = [params]
+				return {"id": "%032X" % random.getrandbits(128), "err_code": 0}
+			if method == "get_rules":
+				return {"rule_list": self.countdown_rules, "err_code": 0}
+
+	def _sysinfo(self):
+		sysinfo = {"sw_ver": self.profile["sw_ver"], "hw_ver": self.profile["hw_ver"], "model": "%s(US)" % self.model,
+				   "deviceId": self.device_id, "oemId": "5C9E6254BEBAED63B2B6102966D24C17",
+				   "hwId": "34C41AA028022D0CCEA5E678E8547C54", "rssi": -52, "alias": "Emulated %s" % self.model,
+				   "mic_type": "IOT.SMARTPLUGSWITCH", "feature": self.profile["feature"], "mac": self.mac,
+				   "updating": 0, "led_off": 0, "err_code": 0}
+		now = time.time()
+		if self.profile["children"]:
+			sysinfo["children"] = [{"id": self.child_id(i), "state": self.relay_state[i], "alias": "Outlet %s" % (i + 1),
+									"on_time": int(now - self.on_since[i]) if self.relay_state[i] else 0,
+									"next_action": {"type": -1}} for i in range(self.profile["children"])]
+			sysinfo["child_num"] = self.profile["children"]
+		else:
+			sysinfo["relay_state"] = self.relay_state[0]
+			sysinfo["on_time"] = int(now - self.on_since[0]) if self.relay_state[0] else 0
+		return sysinfo
+
+
+class _Server(socketserver.ThreadingTCPServer):
+	allow_reuse_address = True
+	daemon_threads = True
+
+
+class KasaEmulator(object):
+	"""
+	TCP server for one ``EmulatedDevice`` with optional fault injection.
+
+	``latency`` delays every response, ``split`` sends responses in segments
+	of that many bytes, ``drop_rate`` is the chance that a request closes the
+	connection without an answer and ``hang_rate`` the chance that it is never
+	answered while the socket stays open. ``requests`` counts handled requests.
+	"""
+
+	def __init__(self, device, host="127.0.0.1", port=protocol.KASA_PORT, latency=0.0, split=0, drop_rate=0.0,
+				 hang_rate=0.0):
+		self.device = device
+		self.latency = latency
+		self.split = split
+		self.drop_rate = drop_rate
+		self.hang_rate = hang_rate
+		self.requests = 0
+		self.connections = 0
+		self._closed = threading.Event()
+		emulator = self
+
+		class Handler(socketserver.BaseRequestHandler):
+			def handle(self):
+				emulator._serve(self.request)
+
+		self._server = _Server((host, port), Handler)
+		self.address = self._server.server_address
+		self._thread = None
+		# devices also answer unframed requests on UDP, used by the plugin's broadcast status sweep
+		self._udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+		self._udp.bind(self.address)
+		self._udp.settimeout(0.5)
+
+	def start(self):
+		self._thread = threading.Thread(target=self._server.serve_forever)
+		self._thread.daemon = True
+		self._thread.start()
+		udp_thread = threading.Thread(target=self._serve_udp)
+		udp_thread.daemon = True
+		udp_thread.start()
+		return self
+
+	def stop(self):
+		self._closed.set()
+		self._server.shutdown()
+		self._server.server_close()
+		self._udp.close()
+
+	def _serve_udp(self):
+		while not self._closed.is_set():
+			try:
+				payload, sender = self._udp.recvfrom(65535)
+			except socket.timeout:
+				continue
+			except socket.error:
+				return
+			self.requests += 1
+			if random.random() < self.drop_rate + self.hang_rate:
+				continue
+			if self.latency:
+				time.sleep(self.latency)
+			try:
+				response = self.device.handle(json.loads(protocol.decrypt(payload)))
+			except ValueError:
+				continue
+			self._udp.sendto(protocol.encode_payload(json.dumps(response).encode('latin-1')), sender)
+
+	def _serve(self, sock):
+		self.connections += 1
+		while not self._closed.is_set():
+			header = self._recv_exactly(sock, 4)
+			if header is None:
+				return
+			payload = self._recv_exactly(sock, unpack('>I', header)[0])
+			if payload is None:
+				return
+			self.requests += 1
+			roll = random.random()
+			if roll < self.drop_rate:
+				sock.close()
+				return
+			if roll < self.drop_rate + self.hang_rate:
+				self._closed.wait()
+				return
+			if self.latency:
+				time.sleep(self.latency)
+			try:
+				request = json.loads(protocol.decrypt(payload))
+				response = self.device.handle(request)
+			except ValueError:
+				response = {"err_code": -1, "err_msg": "json decode error"}
+			data = protocol.encrypt(json.dumps(response))
+			try:
+				if self.split:
+					for offset in range(0, len(data), self.split):
+						sock.sendall(data[offset:offset + self.split])
+						time.sleep(0.001)
+				else:
+					sock.sendall(data)
+			except socket.error:
+				return
+
+	@staticmethod
+	def _recv_exactly(sock, length):
+		data = b""
+		while len(data) < length:
+			try:
+				chunk = sock.recv(length - len(data))
+			except socket.error:
+				return None
+			if not chunk:
+				return None
+			data += chunk
+		return data
+
+
+def main():
+	parser = argparse.ArgumentParser(description="Emulate a Kasa smart plug on the local network.")
+	parser.add_argument("--model", choices=sorted(MODELS), default="HS110")
+	parser.add_argument("--host", default="127.0.0.1")
+	parser.add_argument("--port", type=int, default=protocol.KASA_PORT)
+	parser.add_argument("--latency", type=float, default=0.0, help="seconds before every response")
+	parser.add_argument("--split", type=int, default=0, help="send responses in segments of this many bytes")
+	parser.add_argument("--drop-rate", type=float, default=0.0, help="chance of closing the connection instead of answering")
+	parser.add_argument("--hang-rate", type=float, default=0.0, help="chance of never answering a request")
+	args = parser.parse_args()
+
+	emulator = KasaEmulator(EmulatedDevice(args.model), host=args.host, port=args.port, latency=args.latency,
+							split=args.split, drop_rate=args.drop_rate, hang_rate=args.hang_rate).start()
+	print("Emulating %s at %s:%s, press Ctrl-C to stop." % ((args.model,) + emulator.address))
+	try:
+		while True:
+			time.sleep(1)
+	except KeyboardInterrupt:
+		emulator.stop()
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,197 @@
+# coding=utf-8
+"""
+End-to-end benchmark of the plugin I/O paths against emulated Kasa devices.
+
+Starts one ``kasa_emulator.KasaEmulator`` per device on 127.0.1.x and drives
+``sendCommand``, ``check_status``, ``check_statuses`` and the energy data
+writer of a plugin instance set up through ``on_startup`` in a temporary
+data folder. Reports throughput, p50/p99 latency, energy rows and SQLite
+commits for every phase. HS300 strips count as one device with six plugs.
+
+Needs OctoPrint installed, run from the repository root:
+	python extras/benchmarks/plugin_benchmark.py --devices 1,10,100 --latency 0.02
+"""
+from __future__ import absolute_import, print_function
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import kasa_emulator
+
+from octoprint_tplinksmartplug import tplinksmartplugPlugin
+from octoprint_tplinksmartplug.protocol import KasaConnectionPool
+
+
+class BenchmarkSettings(object):
+	"""
+	Plugin settings backed by a plain dict, in place of the settings object OctoPrint injects.
+	"""
+
+	def __init__(self, values, log_path):
+		self.values = values
+		self.log_path = log_path
+
+	def get(self, path):
+		return self.values[path[0]]
+
+	def get_boolean(self, path):
+		return bool(self.get(path))
+
+	def get_int(self, path):
+		return int(self.get(path))
+
+	def get_float(self, path):
+		return float(self.get(path))
+
+	def get_plugin_logfile_path(self, postfix=None):
+		return self.log_path
+
+
+class IdlePrinter(object):
+
+	def is_printing(self):
+		return False
+
+	def is_paused(self):
+		return False
+
+
+class MessageSink(object):
+
+	def __init__(self):
+		self.messages = 0
+
+	def send_plugin_message(self, identifier, data):
+		self.messages += 1
+
+
+def percentile(values, fraction):
+	if not values:
+		return 0.0
+	values = sorted(values)
+	return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def start_devices(count, models, port, args):
+	emulators, plugs = [], []
+	for n in range(count):
+		model = models[n % len(models)]
+		host = "127.0.1.%s" % (n + 1)
+		emulators.append(kasa_emulator.KasaEmulator(kasa_emulator.EmulatedDevice(model), host=host, port=port,
+													latency=args.latency, split=args.split, drop_rate=args.drop_rate,
+													hang_rate=args.hang_rate).start())
+		children = kasa_emulator.MODELS[model]["children"]
+		for ip in (["%s/%s" % (host, i) for i in range(1, children + 1)] if children else [host]):
+			plugs.append(dict(ip=ip, label="%s %s" % (model, ip)))
+	return emulators, plugs
+
+
+def setup_plugin(plugs, data_folder, args):
+	plugin = tplinksmartplugPlugin()
+	settings = plugin.get_settings_defaults()
+	settings.update(arrSmartplugs=plugs, pollingEnabled=False)
+	plugin._settings = BenchmarkSettings(settings, os.path.join(data_folder, "debug.log"))
+	plugin._printer = IdlePrinter()
+	plugin._plugin_manager = MessageSink()
+	plugin._identifier = "tplinksmartplug"
+	plugin._data_folder = data_folder
+	plugin.on_startup("127.0.0.1", 5000)
+	plugin._tplinksmartplug_logger.setLevel(logging.WARNING)
+	plugin._connection_pool = KasaConnectionPool(port=args.port, read_timeout=args.timeout,
+												 logger=plugin._tplinksmartplug_logger)
+	plugin._plugs.rebuild(plugs)
+	return plugin
+
+
+def run_phase(plugin, name, calls, func, failed):
+	writer = plugin._energy_writer
+	writer.flush()
+	rows, commits = writer.rows_written, writer.commits
+	latencies, errors = [], 0
+	started = time.time()
+	for call in calls:
+		begin = time.time()
+		result = func(call)
+		latencies.append(time.time() - begin)
+		errors += failed(result)
+	elapsed = time.time() - started
+	writer.flush()
+	return dict(phase=name, calls=len(calls), rate=len(calls) / elapsed if elapsed else 0.0,
+				p50=percentile(latencies, 0.5) * 1000, p99=percentile(latencies, 0.99) * 1000, errors=errors,
+				rows=writer.rows_written - rows, commits=writer.commits - commits)
+
+
+def benchmark(count, models, args):
+	emulators, plugs = start_devices(count, models, args.port, args)
+	data_folder = tempfile.mkdtemp(prefix="tplinksmartplug-benchmark-")
+	plugin = setup_plugin(plugs, data_folder, args)
+	sysinfo = json.loads('{"system":{"get_sysinfo":{}}}')
+	try:
+		def send_command(plug):
+			host, _, child = plug["ip"].partition("/")
+			return plugin.sendCommand(dict(sysinfo), host, int(child or 0))
+
+		def check_status(plug):
+			# measure device round trips rather than status cache hits
+			plugin._status_cache.invalidate(plug["ip"])
+			return plugin.check_status(plug["ip"])
+
+		def check_statuses(_):
+			plugin._status_cache.invalidate()
+			return plugin.check_statuses()
+
+		def unreachable(response):
+			return int(plugin.deep_get(response, ["system", "get_sysinfo", "relay_state"]) == 3)
+
+		def unknown(status):
+			return int(not status or status.get("currentState") == "unknown")
+
+		calls = plugs * args.iterations
+		results = [run_phase(plugin, "sendCommand", calls, send_command, unreachable),
+				   run_phase(plugin, "check_status", calls, check_status, unknown),
+				   run_phase(plugin, "check_statuses", list(range(args.iterations)), check_statuses,
+							 lambda statuses: len(plugs) - len(statuses))]
+	finally:
+		plugin.on_shutdown()
+		for emulator in emulators:
+			emulator.stop()
+		shutil.rmtree(data_folder, ignore_errors=True)
+	return len(plugs), sum(emulator.requests for emulator in emulators), results
+
+
+def main():
+	parser = argparse.ArgumentParser(description="Benchmark the plugin against emulated Kasa devices.")
+	parser.add_argument("--devices", default="1,10,100", help="comma separated device counts, at most 250")
+	parser.add_argument("--models", default="HS100,HS110,KP115,HS300", help="device models to cycle through")
+	parser.add_argument("--iterations", type=int, default=5)
+	parser.add_argument("--port", type=int, default=kasa_emulator.protocol.KASA_PORT)
+	parser.add_argument("--timeout", type=float, default=2.0, help="read timeout of the plugin connection pool")
+	parser.add_argument("--latency", type=float, default=0.0)
+	parser.add_argument("--split", type=int, default=0)
+	parser.add_argument("--drop-rate", type=float, default=0.0)
+	parser.add_argument("--hang-rate", type=float, default=0.0)
+	args = parser.parse_args()
+
+	models = [model.strip() for model in args.models.split(",")]
+	print("%-8s %-6s %-15s %7s %10s %9s %9s %7s %7s %8s" % (
+		"devices", "plugs", "phase", "calls", "ops/s", "p50 ms", "p99 ms", "errors", "rows", "commits"))
+	for count in [int(n) for n in args.devices.split(",")]:
+		plugs, requests, results = benchmark(min(count, 250), models, args)
+		for result in results:
+			print("%-8s %-6s %-15s %7d %10.1f %9.2f %9.2f %7d %7d %8d" % (
+				count, plugs, result["phase"], result["calls"], result["rate"], result["p50"], result["p99"],
+				result["errors"], result["rows"], result["commits"]))
+		print("%-8s %-6s %s device requests" % (count, plugs, requests))
+
+
+if __name__ == "__main__":
+	main()
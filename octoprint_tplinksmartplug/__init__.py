@@ -4,7 +4,6 @@ from __future__ import absolute_import
 import octoprint.plugin
 from octoprint.access.permissions import Permissions, ADMIN_GROUP
 from octoprint.events import Events
-from octoprint.util import RepeatedTimer
 from flask_babel import gettext
 import socket
 import json
@@ -18,61 +17,26 @@ import sqlite3
 
 from octoprint.util.version import is_octoprint_compatible
 from uptime import uptime
+from collections import Counter
 from datetime import datetime
-from struct import unpack
-from builtins import bytes
-
-try:
-	from octoprint.util import ResettableTimer
-except:
-	class ResettableTimer(threading.Thread):
-		def __init__(self, interval, function, args=None, kwargs=None, on_reset=None, on_cancelled=None):
-			threading.Thread.__init__(self)
-			self._event = threading.Event()
-			self._mutex = threading.Lock()
-			self.is_reset = True
-
-			if args is None:
-				args = []
-			if kwargs is None:
-				kwargs = dict()
-
-			self.interval = interval
-			self.function = function
-			self.args = args
-			self.kwargs = kwargs
-			self.on_cancelled = on_cancelled
-			self.on_reset = on_reset
-
-		def run(self):
-			while self.is_reset:
-				with self._mutex:
-					self.is_reset = False
-				self._event.wait(self.interval)
-
-			if not self._event.isSet():
-				self.function(*self.args, **self.kwargs)
-			with self._mutex:
-				self._event.set()
-
-		def cancel(self):
-			with self._mutex:
-				self._event.set()
-
-			if callable(self.on_cancelled):
-				self.on_cancelled()
-
-		def reset(self, interval=None):
-			with self._mutex:
-				if interval:
-					self.interval = interval
-
-				self.is_reset = True
-				self._event.set()
-				self._event.clear()
-
-			if callable(self.on_reset):
-				self.on_reset()
+
+from .metrics import HookTimer, Metrics
+from .polling import AdaptivePolling
+from .protocol import HostResolver, KasaConnectionPool, encrypt, decrypt, merge_commands, split_response, udp_sweep
+from .devices import DeviceCache
+from .energy import EnergyDataWriter, create_rollup_tables, get_energy_buckets, get_energy_data, get_energy_rollup
+from .registry import PlugRegistry, parse_plugip
+from .sampling import SampleRing
+from .scheduler import ActionScheduler
+from .status import StatusCache, StatusSweeper
+
+# monotonic clock for idle tracking where available (Python 3)
+monotonic_time = getattr(time, "monotonic", time.time)
+
+POWER_GCODES = frozenset(["M80", "M81"])
+
+# plugs due for a poll within this many seconds of each other share one status sweep
+POLL_COALESCE_SECONDS = 2
 
 
 class tplinksmartplugPlugin(octoprint.plugin.SettingsPlugin,
@@ -81,7 +45,8 @@ class tplinksmartplugPlugin(octoprint.plugin.SettingsPlugin,
 							octoprint.plugin.SimpleApiPlugin,
 							octoprint.plugin.StartupPlugin,
 							octoprint.plugin.ProgressPlugin,
-							octoprint.plugin.EventHandlerPlugin):
+							octoprint.plugin.EventHandlerPlugin,
+							octoprint.plugin.ShutdownPlugin):
 
 	def __init__(self):
 		self._logger = logging.getLogger("octoprint.plugins.tplinksmartplug")
@@ -92,25 +57,55 @@ class tplinksmartplugPlugin(octoprint.plugin.SettingsPlugin,
 		self._countdown_active = False
 		self.print_job_power = 0.0
 		self.print_job_started = False
+		self._print_job_totals = {}
 		self._waitForHeaters = False
 		self._waitForTimelapse = False
 		self._timelapse_active = False
 		self._skipIdleTimer = False
 		self.powerOffWhenIdle = False
-		self._idleTimer = None
+		self._idle_armed = False
+		self._idle_last_activity = monotonic_time()
+		self._idleIgnoreCommandsArray = frozenset()
+		self._thermal_monitoring = False
+		self._thermal_max_bed = 0
+		self._thermal_max_extruder = 0
+		self._thermal_plugs = []
+		self._thermal_latest = {}
+		self._thermal_tripped = set()
+		self._thermal_wakeup = threading.Event()
+		self._metrics = Metrics()
+		self._hook_timers = dict(gcode_queuing=HookTimer(), atcommand_sending=HookTimer(),
+								 temperatures_received=HookTimer())
 		self._autostart_file = None
 		self.db_path = None
-		self.poll_status = None
+		self._energy_writer = None
+		self._polling = AdaptivePolling()
+		self._polled_plugs = {}
+		self._sampled_plugs = set()
+		self._sample_rings = {}
+		self._sample_windows = {}
+		self._sampling_lease = 0
+		self._sampling_lock = threading.Lock()
 		self.power_off_queue = []
 		self._gcode_queued = False
-		self.active_timers = {"on": {}, "off": {}}
-		self.total_correction = 0
-		self.last_row = [0,0,0,0,0,0,0]
-		self.last_row_entered = False
+		self._energy_state = {}
+		self._connection_pool = KasaConnectionPool(logger=self._tplinksmartplug_logger)
+		self._resolver = HostResolver(logger=self._tplinksmartplug_logger)
+		self._status_sweeper = StatusSweeper(logger=self._tplinksmartplug_logger)
+		self._status_cache = StatusCache()
+		self._energy_lock = threading.Lock()
+		self._devices = DeviceCache(logger=self._tplinksmartplug_logger)
+		self._plugs = PlugRegistry()
+		self._scheduler = ActionScheduler(logger=self._tplinksmartplug_logger)
 
 	##~~ StartupPlugin mixin
 
 	def on_startup(self, host, port):
+		self._scheduler.start()
+		# close keep-alive sockets once idle, devices only accept a few TCP clients
+		self._scheduler.schedule_repeating(max(self._connection_pool.idle_timeout / 2.0, 1), self._evict_idle_connections,
+										   key="evict_idle_connections")
+
 		# setup customized logger
 		from octoprint.logging.handlers import CleaningTimedRotatingFileHandler
 		tplinksmartplug_logging_handler = CleaningTimedRotatingFileHandler(
@@ -123,6 +118,8 @@ class tplinksmartplugPlugin(octoprint.plugin.SettingsPlugin,
 			logging.DEBUG if self._settings.get_boolean(["debug_logging"]) else logging.INFO)
 		self._tplinksmartplug_logger.propagate = False
 
+		self._devices.load(os.path.join(self.get_plugin_data_folder(), "devices.json"))
+
 		self.db_path = os.path.join(self.get_plugin_data_folder(), "energy_data.db")
 		if not os.path.exists(self.db_path):
 			db = sqlite3.connect(self.db_path)
@@ -153,19 +150,33 @@ class tplinksmartplugPlugin(octoprint.plugin.SettingsPlugin,
 			db.commit()
 			cursor.execute('''VACUUM''')
 
-		self.last_row = list(cursor.execute('''SELECT id, timestamp, voltage, current, power, total, grandtotal
-			FROM energy_data ORDER BY ROWID DESC LIMIT 1''').fetchone() or [0,0,0,0,0,0,0]) #Round to remove floating point imprecision
-		self.last_row = self.last_row[:2] + [round(x,6) for x in self.last_row[2:]] #Round to correct floating point imprecision in sqlite
-		self.last_row_entered = True
-		self.total_correction = self.last_row[6] - self.last_row[5] #grandtotal - total
+		#Index graph queries by plug and time, created once on existing databases
+		cursor.execute('''CREATE INDEX IF NOT EXISTS energy_data_ip_timestamp ON energy_data (ip, timestamp)''')
+		#Hourly and daily summaries, backfilled from existing rows on first start
+		create_rollup_tables(db)
+
+		#Load the last row of every plug so write suppression and grandtotal correction continue per device
+		for row in cursor.execute('''SELECT ip, timestamp, voltage, current, power, total, grandtotal FROM energy_data
+			WHERE id IN (SELECT MAX(id) FROM energy_data GROUP BY ip)''').fetchall():
+			last_row = list(row[:2]) + [round(x, 6) if isinstance(x, (int, float)) else x for x in row[2:]] #Round to correct floating point imprecision in sqlite
+			self._energy_state[row[0]] = dict(last_row=last_row, last_row_entered=True,
+											  total_correction=(last_row[6] or 0) - (last_row[5] or 0)) #grandtotal - total
 		db.commit()
 		db.close()
 
+		self._energy_writer = EnergyDataWriter(self.db_path,
+											   retention_days=self._settings.get_int(["energy_data_retention_days"]),
+											   logger=self._tplinksmartplug_logger, metrics=self._metrics)
+		self._energy_writer.start()
+
 	def on_after_startup(self):
 		self._logger.info("TPLinkSmartplug loaded!")
-		if self._settings.get(["pollingEnabled"]):
-			self.poll_status = RepeatedTimer(int(self._settings.get(["pollingInterval"])) * 60, self.check_statuses)
-			self.poll_status.start()
+		self._plugs.rebuild(self._settings.get(["arrSmartplugs"]))
+		self._refresh_thermal_settings()
+		thermal_monitor = threading.Thread(target=self._thermal_monitor_loop)
+		thermal_monitor.daemon = True
+		thermal_monitor.start()
+		self._start_polling()
 
 		self.abortTimeout = self._settings.get_int(["abortTimeout"])
 		self._tplinksmartplug_logger.debug("abortTimeout: %s" % self.abortTimeout)
@@ -176,13 +187,13 @@ class tplinksmartplugPlugin(octoprint.plugin.SettingsPlugin,
 		self.idleTimeout = self._settings.get_int(["idleTimeout"])
 		self._tplinksmartplug_logger.debug("idleTimeout: %s" % self.idleTimeout)
 		self.idleIgnoreCommands = self._settings.get(["idleIgnoreCommands"])
-		self._idleIgnoreCommandsArray = self.idleIgnoreCommands.replace(" ", "").split(',')
+		self._idleIgnoreCommandsArray = frozenset(self.idleIgnoreCommands.replace(" ", "").split(','))
 		self._tplinksmartplug_logger.debug("idleIgnoreCommands: %s" % self.idleIgnoreCommands)
 		self.idleTimeoutWaitTemp = self._settings.get_int(["idleTimeoutWaitTemp"])
 		self._tplinksmartplug_logger.debug("idleTimeoutWaitTemp: %s" % self.idleTimeoutWaitTemp)
 		if self._settings.get_boolean(["event_on_startup_monitoring"]) is True:
 			self._tplinksmartplug_logger.debug("powering on due to startup.")
-			for plug in self._settings.get(['arrSmartplugs']):
+			for plug in self._plugs:
 				if plug["event_on_startup"] is True:
 					self._tplinksmartplug_logger.debug("powering on %s due to startup." % (plug["ip"]))
 					response = self.turn_on(plug["ip"])
@@ -197,7 +208,7 @@ class tplinksmartplugPlugin(octoprint.plugin.SettingsPlugin,
 		if hasattr(self, 'loaded') is False: return None
 		if self._settings.get_boolean(["connect_on_connect_request"]) is True:
 			self._tplinksmartplug_logger.debug("powering on due to 'Connect' request.")
-			for plug in self._settings.get(['arrSmartplugs']):
+			for plug in self._plugs:
 				if plug["connect_on_connect"] is True and self._printer.is_closed_or_error():
 					self._tplinksmartplug_logger.debug("powering on %s due to 'Connect' request." % (plug["ip"]))
 					response = self.turn_on(plug["ip"])
@@ -208,6 +219,20 @@ class tplinksmartplugPlugin(octoprint.plugin.SettingsPlugin,
 						self._tplinksmartplug_logger.debug("powering on %s during 'Connect' failed." % (plug["ip"]))
 		return None
 
+	def _evict_idle_connections(self):
+		self._connection_pool.evict_idle()
+
+	##~~ ShutdownPlugin mixin
+
+	def on_shutdown(self):
+		self._scheduler.stop()
+		self._status_sweeper.shutdown()
+		self._connection_pool.cancel()
+		self._connection_pool.close_all()
+		self._stop_sampling()
+		if self._energy_writer is not None:
+			self._energy_writer.stop()
+
 	##~~ SettingsPlugin mixin
 
 	def get_settings_defaults(self):
@@ -217,27 +242,34 @@ class tplinksmartplugPlugin(octoprint.plugin.SettingsPlugin,
 				'event_on_upload_monitoring': False, 'event_on_upload_monitoring_always': False,
 				'event_on_startup_monitoring': False, 'event_on_shutdown_monitoring': False, 'cost_rate': 0,
 				'abortTimeout': 30, 'powerOffWhenIdle': False, 'idleTimeout': 30, 'idleIgnoreCommands': 'M105',
-				'idleIgnoreHeaters': '', 'idleTimeoutWaitTemp': 50, 'progress_polling': False, 'useDropDown': False}
+				'idleIgnoreHeaters': '', 'idleTimeoutWaitTemp': 50, 'progress_polling': False, 'useDropDown': False,
+				'energy_data_retention_days': 0, 'udp_status_sweep': False, 'udp_sweep_address': '255.255.255.255',
+				'live_sampling': False, 'live_sampling_interval': 1, 'live_sampling_decimate': 60}
 
 	def on_settings_save(self, data):
 		old_debug_logging = self._settings.get_boolean(["debug_logging"])
-		old_polling_value = self._settings.get_boolean(["pollingEnabled"])
-		old_polling_timer = self._settings.get(["pollingInterval"])
 		old_powerOffWhenIdle = self._settings.get_boolean(["powerOffWhenIdle"])
 		old_idleTimeout = self._settings.get_int(["idleTimeout"])
 		old_idleIgnoreCommands = self._settings.get(["idleIgnoreCommands"])
 		old_idleTimeoutWaitTemp = self._settings.get_int(["idleTimeoutWaitTemp"])
 
 		octoprint.plugin.SettingsPlugin.on_settings_save(self, data)
+		self._plugs.rebuild(self._settings.get(["arrSmartplugs"]))
 
 		self.abortTimeout = self._settings.get_int(["abortTimeout"])
 		self.powerOffWhenIdle = self._settings.get_boolean(["powerOffWhenIdle"])
 
 		self.idleTimeout = self._settings.get_int(["idleTimeout"])
 		self.idleIgnoreCommands = self._settings.get(["idleIgnoreCommands"])
-		self._idleIgnoreCommandsArray = self.idleIgnoreCommands.replace(" ", "").split(',')
+		self._idleIgnoreCommandsArray = frozenset(self.idleIgnoreCommands.replace(" ", "").split(','))
 		self.idleTimeoutWaitTemp = self._settings.get_int(["idleTimeoutWaitTemp"])
 
+		self._refresh_thermal_settings()
+		self._update_sampling(restart=True)
+
+		if self._energy_writer is not None:
+			self._energy_writer.retention_days = self._settings.get_int(["energy_data_retention_days"])
+
 		if self.powerOffWhenIdle != old_powerOffWhenIdle:
 			self._plugin_manager.send_plugin_message(self._identifier,
 													 dict(powerOffWhenIdle=self.powerOffWhenIdle, type="timeout",
@@ -248,8 +280,6 @@ class tplinksmartplugPlugin(octoprint.plugin.SettingsPlugin,
 			self._reset_idle_timer()
 
 		new_debug_logging = self._settings.get_boolean(["debug_logging"])
-		new_polling_value = self._settings.get_boolean(["pollingEnabled"])
-		new_polling_timer = self._settings.get(["pollingInterval"])
 
 		if old_debug_logging != new_debug_logging:
 			if new_debug_logging:
@@ -257,17 +287,11 @@ class tplinksmartplugPlugin(octoprint.plugin.SettingsPlugin,
 			else:
 				self._tplinksmartplug_logger.setLevel(logging.INFO)
 
-		if old_polling_value != new_polling_value or old_polling_timer != new_polling_timer:
-			if self.poll_status is not None:
-				self.poll_status.cancel()
-				self.poll_status = None
-
-			if new_polling_value:
-				self.poll_status = RepeatedTimer(int(self._settings.get(["pollingInterval"])) * 60, self.check_statuses)
-				self.poll_status.start()
+		# plugs or their polling intervals may have changed as well
+		self._start_polling()
 
 	def get_settings_version(self):
-		return 16
+		return 18
 
 	def on_settings_migrate(self, target, current=None):
 		if current is None or current < 5:
@@ -361,6 +385,24 @@ class tplinksmartplugPlugin(octoprint.plugin.SettingsPlugin,
 				arrSmartplugs_new.append(plug)
 			self._settings.set(["arrSmartplugs"], arrSmartplugs_new)
 
+		if current is not None and current < 17:
+			arrSmartplugs_new = []
+			for plug in self._settings.get(['arrSmartplugs']):
+				plug["pollingFastInterval"] = 10
+				plug["pollingSlowInterval"] = 0
+				arrSmartplugs_new.append(plug)
+			self._settings.set(["arrSmartplugs"], arrSmartplugs_new)
+		if current is not None and current < 18:
+			# device ids moved to devices.json, drop the "ip/N" keys earlier versions cached at the top level
+			plugips = set()
+			for plug in self._settings.get(['arrSmartplugs']):
+				plugips.update([plug["ip"], plug["ip"].split("/")[0]])
+			defaults = self.get_settings_defaults()
+			for key in list((self._settings.get_all_data(merged=False) or {}).keys()):
+				if key not in defaults and (key in plugips or re.match(r'^[^/]+/\d+$', key)):
+					self._tplinksmartplug_logger.info("Removing cached device id %s from settings." % key)
+					self._settings.remove([key])
+
 	##~~ AssetPlugin mixin
 
 	def get_assets(self):
@@ -403,10 +445,9 @@ class tplinksmartplugPlugin(octoprint.plugin.SettingsPlugin,
 		if self._settings.get_boolean(["progress_polling"]) is False:
 			return
 		self._tplinksmartplug_logger.debug("Checking statuses during print progress (%s)." % progress)
-		_print_progress_timer = threading.Timer(1, self.check_statuses)
-		_print_progress_timer.daemon = True
-		_print_progress_timer.start()
-		self._plugin_manager.send_plugin_message(self._identifier, dict(updatePlot=True))
+		if not self._settings.get_boolean(["pollingEnabled"]):
+			# adaptive polling already checks plugs at their fast interval while printing
+			self._scheduler.schedule(1, self.check_statuses, key="progress_polling", blocking=True)
 
 		if self.powerOffWhenIdle is True and not (self._skipIdleTimer is True):
 			self._tplinksmartplug_logger.debug("Resetting idle timer during print progress (%s)..." % progress)
@@ -417,13 +458,9 @@ class tplinksmartplugPlugin(octoprint.plugin.SettingsPlugin,
 
 	def turn_on(self, plugip):
 		self._tplinksmartplug_logger.debug("Turning on %s." % plugip)
-		plug = self.plug_search(self._settings.get(["arrSmartplugs"]), "ip", plugip)
+		plug = self._plugs.get(plugip)
 		self._tplinksmartplug_logger.debug(plug)
-		if "/" in plugip:
-			plug_ip, plug_num = plugip.split("/")
-		else:
-			plug_ip = plugip
-			plug_num = 0
+		plug_ip, plug_num = parse_plugip(plugip)
 		if plug["useCountdownRules"] and int(plug["countdownOnDelay"]) > 0:
 			self.sendCommand(json.loads('{"count_down":{"delete_all_rules":null}}'), plug_ip, plug_num)
 			chk = self.lookup(self.sendCommand(json.loads(
@@ -431,10 +468,8 @@ class tplinksmartplugPlugin(octoprint.plugin.SettingsPlugin,
 					"countdownOnDelay"]), plug_ip, plug_num), *["count_down", "add_rule", "err_code"])
 			if chk == 0:
 				self._countdown_active = True
-				c = threading.Timer(int(plug["countdownOnDelay"]) + 3, self._plugin_manager.send_plugin_message,
-									[self._identifier, dict(check_status=True, ip=plugip)])
-				c.daemon = True
-				c.start()
+				self._scheduler.schedule(int(plug["countdownOnDelay"]) + 3, self._plugin_manager.send_plugin_message,
+										 [self._identifier, dict(check_status=True, ip=plugip)], key=(plugip, "countdown"))
 		else:
 			turn_on_cmnd = dict(system=dict(set_relay_state=dict(state=1)))
 			chk = self.lookup(self.sendCommand(turn_on_cmnd, plug_ip, plug_num),
@@ -443,9 +478,8 @@ class tplinksmartplugPlugin(octoprint.plugin.SettingsPlugin,
 		self._tplinksmartplug_logger.debug(chk)
 		if chk == 0:
 			if plug["autoConnect"] and self._printer.is_closed_or_error():
-				c = threading.Timer(int(plug["autoConnectDelay"]), self._printer.connect)
-				c.daemon = True
-				c.start()
+				self._scheduler.schedule(int(plug["autoConnectDelay"]), self._printer.connect,
+										 key=(plugip, "autoConnect"), blocking=True)
 			if plug["gcodeCmdOn"] and self._printer.is_closed_or_error():
 				self._tplinksmartplug_logger.debug("queuing gcode on commands because printer isn't connected yet.")
 				self._gcode_queued = True
@@ -453,27 +487,24 @@ class tplinksmartplugPlugin(octoprint.plugin.SettingsPlugin,
 				self._tplinksmartplug_logger.debug("sending gcode commands to printer.")
 				self._printer.commands(plug["gcodeRunCmdOn"].split("\n"))
 			if plug["sysCmdOn"]:
-				t = threading.Timer(int(plug["sysCmdOnDelay"]), os.system, args=[plug["sysRunCmdOn"]])
-				t.daemon = True
-				t.start()
+				self._scheduler.schedule(int(plug["sysCmdOnDelay"]), os.system, [plug["sysRunCmdOn"]],
+										 key=(plugip, "sysCmdOn"), blocking=True)
 			if self.powerOffWhenIdle is True and plug["automaticShutdownEnabled"] is True:
 				self._tplinksmartplug_logger.debug("Resetting idle timer since plug %s was just turned on." % plugip)
 				self._waitForHeaters = False
 				self._reset_idle_timer()
 
+		self._status_cache.invalidate(plugip)
+		self._poll_soon(plugip)
 		return self.check_status(plugip)
 
 	def turn_off(self, plugip):
 		timenow = datetime.now()
 		self._tplinksmartplug_logger.debug("Turning off %s." % plugip)
 		self._tplinksmartplug_logger.info("Turning off %s at %s" % (plugip, timenow))
-		plug = self.plug_search(self._settings.get(["arrSmartplugs"]), "ip", plugip)
+		plug = self._plugs.get(plugip)
 		self._tplinksmartplug_logger.debug(plug)
-		if "/" in plugip:
-			plug_ip, plug_num = plugip.split("/")
-		else:
-			plug_ip = plugip
-			plug_num = 0
+		plug_ip, plug_num = parse_plugip(plugip)
 		if plug["useCountdownRules"] and int(plug["countdownOffDelay"]) > 0:
 			self.sendCommand(json.loads('{"count_down":{"delete_all_rules":null}}'), plug_ip, plug_num)
 			chk = self.lookup(self.sendCommand(json.loads(
@@ -481,16 +512,14 @@ class tplinksmartplugPlugin(octoprint.plugin.SettingsPlugin,
 					"countdownOffDelay"]), plug_ip, plug_num), *["count_down", "add_rule", "err_code"])
 			if chk == 0:
 				self._countdown_active = True
-				c = threading.Timer(int(plug["countdownOffDelay"]) + 3, self._plugin_manager.send_plugin_message,
-									[self._identifier, dict(check_status=True, ip=plugip)])
-				c.start()
+				self._scheduler.schedule(int(plug["countdownOffDelay"]) + 3, self._plugin_manager.send_plugin_message,
+										 [self._identifier, dict(check_status=True, ip=plugip)], key=(plugip, "countdown"))
 		if plug["gcodeCmdOff"] and plug["gcodeRunCmdOff"] != "":
 			self._tplinksmartplug_logger.debug("sending gcode commands to printer.")
 			self._printer.commands(plug["gcodeRunCmdOff"].split("\n"))
 		if plug["sysCmdOff"]:
-			t = threading.Timer(int(plug["sysCmdOffDelay"]), os.system, args=[plug["sysRunCmdOff"]])
-			t.daemon = True
-			t.start()
+			self._scheduler.schedule(int(plug["sysCmdOffDelay"]), os.system, [plug["sysRunCmdOff"]],
+									 key=(plugip, "sysCmdOff"), blocking=True)
 		if plug["autoDisconnect"]:
 			self._printer.disconnect()
 			time.sleep(int(plug["autoDisconnectDelay"]))
@@ -502,106 +531,292 @@ class tplinksmartplugPlugin(octoprint.plugin.SettingsPlugin,
 
 		self._tplinksmartplug_logger.debug(chk)
 
+		self._status_cache.invalidate(plugip)
+		self._poll_soon(plugip)
 		return self.check_status(plugip)
 
-	def check_statuses(self):
-		for plug in self._settings.get(["arrSmartplugs"]):
-			chk = self.check_status(plug["ip"])
-			self._plugin_manager.send_plugin_message(self._identifier, chk)
+	def check_statuses(self, plugips=None):
+		if plugips is None:
+			plugips = [plug.ip for plug in self._plugs]
+		plugips = [plugip for plugip in plugips if plugip]
+		statuses = {}
+		if self._settings.get_boolean(["udp_status_sweep"]):
+			responses = self._udp_responses()
+			statuses = self._status_sweeper.sweep(
+				[plugip for plugip in plugips if plugip in responses],
+				lambda plugip: self._status_cache.get(plugip, lambda key: self._status_from_response(key, *responses[key])),
+				callback=self._send_status)
+			self._tplinksmartplug_logger.debug("UDP sweep answered for %s of %s plug(s)." % (len(statuses), len(plugips)))
+		# plugs that did not answer the UDP sweep fall back to TCP
+		plugips = [plugip for plugip in plugips if plugip not in statuses]
+		outlets = Counter(parse_plugip(plugip)[0] for plugip in plugips)
+		strips = set(host for host, count in outlets.items() if count > 1)
+		# outlets of a strip share one sysinfo query per sweep, their emeter reads still run in parallel
+		host_sysinfo = StatusCache(ttl=self._status_sweeper.deadline)
+
+		def check(plugip):
+			if parse_plugip(plugip)[0] in strips:
+				return self._check_outlet_status(plugip, host_sysinfo)
+			return self.check_status(plugip)
+
+		statuses.update(self._status_sweeper.sweep(plugips, check, callback=self._send_status))
+		return statuses
+
+	def _check_outlet_status(self, plugip, host_sysinfo):
+		# the first outlet queries sysinfo batched with its own emeter read, the others reuse that sysinfo and only
+		# read their emeter, firmware reports emeter data for one child per request so a strip costs one request per outlet
+		def query(key):
+			fetched = []
+
+			def fetch(host):
+				fetched.append(key)
+				return self._fetch_status(key)
+
+			response, check_emeter_data = host_sysinfo.get(parse_plugip(key)[0], fetch)
+			return self._status_from_response(key, response, check_emeter_data if fetched else None)
+
+		return self._status_cache.get(plugip, query)
+
+	def _udp_responses(self):
+		# one sysinfo and emeter datagram for every device, replies are matched to plugs by ip or by known mac address
+		request = json.dumps(merge_commands([dict(system=dict(get_sysinfo=dict())), dict(emeter=dict(get_realtime=dict()))]))
+		try:
+			replies = udp_sweep(request, self._settings.get(["udp_sweep_address"]))
+		except socket.error:
+			self._tplinksmartplug_logger.exception("UDP status sweep failed.")
+			return {}
+		hosts = set(plug.host for plug in self._plugs)
+		responses = {}
+		for ip, reply in replies.items():
+			try:
+				response = json.loads(reply)
+			except ValueError:
+				continue
+			host = ip if ip in hosts else self._devices.host_for_mac(
+				self.deep_get(response, ["system", "get_sysinfo", "mac"]) or self.deep_get(response, ["system", "get_sysinfo", "mic_mac"]))
+			if host is not None:
+				responses[host] = response
+		plug_responses = {}
+		for plug in self._plugs:
+			response = responses.get(plug.host)
+			if response is None:
+				continue
+			# the reply only carries device wide emeter data, strip outlets still read theirs over TCP
+			emeter = None
+			if not plug.child and self.lookup(response, *["emeter", "get_realtime"]):
+				emeter = dict(emeter=response["emeter"])
+			plug_responses[plug.ip] = (response, emeter)
+		return plug_responses
+
+	def _send_status(self, status):
+		self._plugin_manager.send_plugin_message(self._identifier, status)
+
+	##~~ Adaptive Polling
+
+	def _start_polling(self):
+		# next poll time of every polled plug, one scheduled action polls whichever plugs are due
+		self._scheduler.cancel("poll")
+		self._polled_plugs = {}
+		if not self._settings.get_boolean(["pollingEnabled"]):
+			return
+		now = monotonic_time()
+		for plug in self._plugs:
+			if plug.ip:
+				self._polled_plugs[plug.ip] = now + self._polling_intervals(plug)[0]
+		self._schedule_poll()
+
+	def _poll_soon(self, plugip):
+		plug = self._plugs.get(plugip)
+		if plug is not None and plug.ip in self._polled_plugs:
+			self._polled_plugs[plug.ip] = monotonic_time() + self._polling_intervals(plug)[0]
+			self._schedule_poll()
+
+	def _schedule_poll(self):
+		due = list(self._polled_plugs.values())
+		if due:
+			self._scheduler.schedule(min(due) - monotonic_time(), self._poll_due_plugs, key="poll", blocking=True)
+
+	def _polling_intervals(self, plug):
+		# per plug fast and slow intervals in seconds, slow defaults to the global polling interval
+		fast = max(int(plug.get("pollingFastInterval") or 10), 1)
+		slow = int(plug.get("pollingSlowInterval") or 0) or self._settings.get_int(["pollingInterval"]) * 60
+		return fast, max(slow, fast)
+
+	def _poll_due_plugs(self):
+		# plugs due at about the same time go through one sweep, UDP first when enabled and TCP for the rest
+		now = monotonic_time()
+		due = [plugip for plugip, when in list(self._polled_plugs.items()) if when <= now + POLL_COALESCE_SECONDS]
+		statuses = {}
+		try:
+			if due:
+				statuses = self.check_statuses(due)
+		finally:
+			printing = self._printer.is_printing()
+			for plugip in due:
+				plug = self._plugs.get(plugip)
+				if plug is None or plugip not in self._polled_plugs:
+					continue
+				fast, slow = self._polling_intervals(plug)
+				interval = self._polling.next_interval(plugip, statuses.get(plugip), fast, slow, printing=printing)
+				self._tplinksmartplug_logger.debug("Next poll of %s in %ss." % (plugip, interval))
+				self._polled_plugs[plugip] = monotonic_time() + interval
+			self._schedule_poll()
+
+	##~~ Live Sampling
+
+	def _sampling_active(self):
+		# sample while printing or while an open tab keeps renewing its lease
+		return self._settings.get_boolean(["live_sampling"]) and (
+			self._printer.is_printing() or monotonic_time() < self._sampling_lease)
+
+	def _update_sampling(self, restart=False):
+		active = self._sampling_active()
+		if self._scheduler.is_pending("sampling") and (restart or not active):
+			self._scheduler.cancel("sampling")
+			if not active:
+				self._stop_sampling()
+		if active and not self._scheduler.is_pending("sampling"):
+			interval = max(self._settings.get_float(["live_sampling_interval"]), 0.5)
+			self._tplinksmartplug_logger.debug("Starting live sampling every %ss." % interval)
+			self._scheduler.schedule_repeating(interval, self._sample_tick, key="sampling", delay=0, blocking=True)
+
+	def _stop_sampling(self):
+		with self._sampling_lock:
+			now = time.time()
+			for plugip in list(self._sampled_plugs):
+				self._flush_samples(plugip, now)
+			self._sampled_plugs = set()
+			self._sample_windows = {}
+
+	def _sample_tick(self):
+		if not self._sampling_active():
+			self._tplinksmartplug_logger.debug("Stopping live sampling.")
+			self._scheduler.cancel("sampling")
+			self._stop_sampling()
+			return
+		plugips = [plug.ip for plug in self._plugs if plug.ip and self._devices.has_emeter(plug.host)]
+		samples = dict((plugip, row) for plugip, row in self._status_sweeper.sweep(plugips, self._sample_plug).items()
+					   if row is not None)
+		if samples:
+			self._plugin_manager.send_plugin_message(self._identifier, dict(liveSamples=samples))
+
+	def _sample_plug(self, plugip):
+		plug_ip, plug_num = parse_plugip(plugip)
+		with self._metrics.timed("sample_seconds", plug=plugip):
+			response = self.sendCommand(dict(emeter=dict(get_realtime=dict())), plug_ip, plug_num)
+		realtime = self.lookup(response, *["emeter", "get_realtime"])
+		if not realtime:
+			return None
+		v, c, p, t = self._emeter_values(realtime)
+		if p == "" or t == "":
+			return None
+		now = time.time()
+		ring = self._sample_rings.get(plugip)
+		if ring is None:
+			ring = self._sample_rings[plugip] = SampleRing()
+		ring.append(now, c, p, v, t)
+		with self._sampling_lock:
+			self._sampled_plugs.add(plugip)
+			# windows start at the first sample of a session, samples of earlier sessions stay out of them
+			if now - self._sample_windows.setdefault(plugip, now) >= self._settings.get_int(["live_sampling_decimate"]):
+				self._flush_samples(plugip, now)
+		gt = round(t + self._get_energy_state(plugip)["total_correction"], 6)
+		return [datetime.fromtimestamp(now).isoformat(' '), c, p, gt, v]
+
+	def _sampled_emeter(self, plugip):
+		# while a plug is live sampled its latest sample stands in for an emeter query, in the units of its firmware
+		ring = self._sample_rings.get(plugip)
+		if plugip not in self._sampled_plugs or ring is None:
+			return None
+		sample = ring.latest()
+		if sample is None or time.time() - sample[0] > 2 * max(self._settings.get_float(["live_sampling_interval"]), 0.5):
+			return None
+		device = self._devices.get(parse_plugip(plugip)[0]) or {}
+		if device.get("emeter_units") == "mW":
+			keys = (("current_ma", 1000), ("power_mw", 1000), ("voltage_mv", 1000), ("total_wh", 1000))
+		else:
+			keys = (("current", 1), ("power", 1), ("voltage", 1), ("total", 1))
+		realtime = dict(err_code=0)
+		for (key, scale), value in zip(keys, sample[1:]):
+			if value is not None:
+				realtime[key] = value * scale
+		return dict(emeter=dict(get_realtime=realtime))
+
+	def _flush_samples(self, plugip, end):
+		# only the window averages reach energy_data, the ring keeps the full resolution
+		if plugip not in self._sample_windows:
+			return
+		summary = self._sample_rings[plugip].summarize(self._sample_windows[plugip], end)
+		self._sample_windows[plugip] = end
+		if summary is not None:
+			timestamp, c, p, v, t = summary
+			self._metrics.inc("live_sample_rows_total", plug=plugip)
+			self._record_energy_row(plugip, datetime.fromtimestamp(timestamp), "" if v is None else v,
+									"" if c is None else c, p, t, push=False)
 
 	def check_status(self, plugip):
+		# concurrent callers for the same plug share one device query
+		return self._status_cache.get(plugip, self._query_status)
+
+	def _query_status(self, plugip):
+		if plugip != "":
+			return self._status_from_response(plugip, *self._fetch_status(plugip))
+
+	def _fetch_status(self, plugip):
 		self._tplinksmartplug_logger.debug("Checking status of %s." % plugip)
 		if plugip != "":
-			emeter_data = None
-			today = datetime.today()
 			check_status_cmnd = dict(system=dict(get_sysinfo=dict()))
-			plug_ip = plugip.split("/")
+			emeter_data_cmnd = dict(emeter=dict(get_realtime=dict()))
+			plug_ip, plug_num = parse_plugip(plugip)
+			# batch the emeter query with sysinfo when the device is already known to have one
+			emeter_known = self._devices.has_emeter(plug_ip)
 			self._tplinksmartplug_logger.debug(check_status_cmnd)
-			if len(plug_ip) == 2:
-				response = self.sendCommand(check_status_cmnd, plug_ip[0], plug_ip[1])
-				timer_chk = self.lookup(response, *["system", "get_sysinfo", "children"])[int(plug_ip[1]) - 1][
-					"on_time"]
+			check_emeter_data = self._sampled_emeter(plugip)
+			if check_emeter_data is not None:
+				response = self.sendCommand(check_status_cmnd, plug_ip, plug_num)
+			elif emeter_known:
+				response, check_emeter_data = self.sendCommands([check_status_cmnd, emeter_data_cmnd], plug_ip, plug_num)
+			else:
+				response = self.sendCommand(check_status_cmnd, plug_ip, plug_num)
+			return response, check_emeter_data
+
+	def _status_from_response(self, plugip, response, check_emeter_data=None):
+		if plugip != "":
+			emeter_data = None
+			today = datetime.today()
+			emeter_data_cmnd = dict(emeter=dict(get_realtime=dict()))
+			plug_ip, plug_num = parse_plugip(plugip)
+			if plug_num:
+				children = self.lookup(response, *["system", "get_sysinfo", "children"]) or []
+				timer_chk = children[plug_num - 1]["on_time"] if len(children) >= plug_num else 0
 			else:
-				response = self.sendCommand(check_status_cmnd, plug_ip[0])
 				timer_chk = self.deep_get(response, ["system", "get_sysinfo", "on_time"], default=0)
 
 			if timer_chk == 0 and self._countdown_active:
 				self._tplinksmartplug_logger.debug("Clearing previously active countdown timer flag")
 				self._countdown_active = False
 
-			self._tplinksmartplug_logger.debug(
-				self.deep_get(response, ["system", "get_sysinfo", "feature"], default=""))
-			if "ENE" in self.deep_get(response, ["system", "get_sysinfo", "feature"], default=""):
-				# if "ENE" in self.lookup(response, *["system","get_sysinfo","feature"]):
-				emeter_data_cmnd = dict(emeter=dict(get_realtime=dict()))
-				if len(plug_ip) == 2:
-					check_emeter_data = self.sendCommand(emeter_data_cmnd, plug_ip[0], plug_ip[1])
-				else:
-					check_emeter_data = self.sendCommand(emeter_data_cmnd, plug_ip[0])
+			feature = self.deep_get(response, ["system", "get_sysinfo", "feature"], default="")
+			self._tplinksmartplug_logger.debug(feature)
+			# cheap comparison while nothing changed, the cache only refreshes when the device does not match it
+			self._devices.update_from_sysinfo(plug_ip, self.deep_get(response, ["system", "get_sysinfo"]))
+			if "ENE" in feature:
+				if check_emeter_data is None:
+					check_emeter_data = self.sendCommand(emeter_data_cmnd, plug_ip, plug_num)
 				if self.lookup(check_emeter_data, *["emeter", "get_realtime"]):
 					emeter_data = check_emeter_data["emeter"]
-					if "voltage_mv" in emeter_data["get_realtime"]:
-						v = emeter_data["get_realtime"]["voltage_mv"] / 1000.0
-					elif "voltage" in emeter_data["get_realtime"]:
-						v = emeter_data["get_realtime"]["voltage"]
-					else:
-						v = ""
-					if "current_ma" in emeter_data["get_realtime"]:
-						c = emeter_data["get_realtime"]["current_ma"] / 1000.0
-					elif "current" in emeter_data["get_realtime"]:
-						c = emeter_data["get_realtime"]["current"]
-					else:
-						c = ""
-					if "power_mw" in emeter_data["get_realtime"]:
-						p = emeter_data["get_realtime"]["power_mw"] / 1000.0
-					elif "power" in emeter_data["get_realtime"]:
-						p = emeter_data["get_realtime"]["power"]
-					else:
-						p = ""
+					self._devices.update_emeter_units(plug_ip, emeter_data["get_realtime"])
+					v, c, p, t = self._emeter_values(emeter_data["get_realtime"])
+					energy_state = self._get_energy_state(plugip)
 					if "total_wh" in emeter_data["get_realtime"]:
-						t = emeter_data["get_realtime"]["total_wh"] / 1000.0
-						emeter_data["get_realtime"]["total_wh"] += self.total_correction * 1000.0 #Add back total correction factor, so becomes grandtotal
+						emeter_data["get_realtime"]["total_wh"] += energy_state["total_correction"] * 1000.0 #Add back total correction factor, so becomes grandtotal
 					elif "total" in emeter_data["get_realtime"]:
-						t = emeter_data["get_realtime"]["total"]
-						emeter_data["get_realtime"]["total"] += self.total_correction  #Add back total correction factor, so becomes grandtotal
-					else:
-						t = ""
-					if self.db_path is not None:
-						last_p = self.last_row[4]
-						last_t = self.last_row[5]
-
-						if last_t is not None and t < last_t: #total has reset since last measurement
-							self.total_correction += last_t
-						gt = round(t + self.total_correction, 6) #Prevent accumulated floating-point rounding errors
-						current_row = [plugip, today.isoformat(' '), v, c, p, t, gt]
-
-						if self.last_row_entered is False and last_p == 0 and p > 0: #Go back & enter last_row on power return (if not entered already)
-							db = sqlite3.connect(self.db_path)
-							cursor = db.cursor()
-							cursor.execute(
-								'''INSERT INTO energy_data(ip, timestamp, voltage, current, power, total, grandtotal) VALUES(?,?,?,?,?,?,?)''',
-								self.last_row)
-							db.commit()
-							db.close()
-							self.last_row_entered = True
-						else:
-							self.last_row_entered = False
-
-						if t != last_t or p > 0 or last_p > 0: #Enter current_row if change in total or power is on or just turned off
-							db = sqlite3.connect(self.db_path)
-							cursor = db.cursor()
-							cursor.execute(
-								'''INSERT INTO energy_data(ip, timestamp, voltage, current, power, total, grandtotal) VALUES(?,?,?,?,?,?,?)''',
-								current_row)
-							db.commit()
-							db.close()
-
-						self.last_row = current_row
-
-			if len(plug_ip) == 2:
-				chk = self.lookup(response, *["system", "get_sysinfo", "children"])
-				if chk:
-					chk = chk[int(plug_ip[1]) - 1]["state"]
+						emeter_data["get_realtime"]["total"] += energy_state["total_correction"]  #Add back total correction factor, so becomes grandtotal
+					if plugip not in self._sampled_plugs: #Live sampling writes its own decimated rows
+						self._record_energy_row(plugip, today, v, c, p, t)
+
+			if plug_num:
+				chk = children[plug_num - 1]["state"] if len(children) >= plug_num else None
 			else:
 				chk = self.lookup(response, *["system", "get_sysinfo", "relay_state"])
 
@@ -613,12 +828,99 @@ class tplinksmartplugPlugin(octoprint.plugin.SettingsPlugin,
 				self._tplinksmartplug_logger.debug(response)
 				return dict(currentState="unknown", emeter=emeter_data, ip=plugip)
 
+	def _emeter_values(self, realtime):
+		if "voltage_mv" in realtime:
+			v = realtime["voltage_mv"] / 1000.0
+		elif "voltage" in realtime:
+			v = realtime["voltage"]
+		else:
+			v = ""
+		if "current_ma" in realtime:
+			c = realtime["current_ma"] / 1000.0
+		elif "current" in realtime:
+			c = realtime["current"]
+		else:
+			c = ""
+		if "power_mw" in realtime:
+			p = realtime["power_mw"] / 1000.0
+		elif "power" in realtime:
+			p = realtime["power"]
+		else:
+			p = ""
+		if "total_wh" in realtime:
+			t = realtime["total_wh"] / 1000.0
+		elif "total" in realtime:
+			t = realtime["total"]
+		else:
+			t = ""
+		return v, c, p, t
+
+	def _record_energy_row(self, plugip, when, v, c, p, t, push=True):
+		if self._energy_writer is None:
+			return
+		energy_state = self._get_energy_state(plugip)
+		inserted = []
+		with self._energy_lock:
+			last_p = energy_state["last_row"][4]
+			last_t = energy_state["last_row"][5]
+
+			if last_t is not None and t < last_t: #total has reset since last measurement
+				energy_state["total_correction"] += last_t
+			gt = round(t + energy_state["total_correction"], 6) #Prevent accumulated floating-point rounding errors
+			current_row = [plugip, when.isoformat(' '), v, c, p, t, gt]
+
+			if energy_state["last_row_entered"] is False and last_p == 0 and p > 0: #Go back & enter last_row on power return (if not entered already)
+				self._energy_writer.insert(energy_state["last_row"])
+				inserted.append(energy_state["last_row"])
+				energy_state["last_row_entered"] = True
+			else:
+				energy_state["last_row_entered"] = False
+
+			if t != last_t or p > 0 or last_p > 0: #Enter current_row if change in total or power is on or just turned off
+				self._energy_writer.insert(current_row)
+				inserted.append(current_row)
+			else:
+				self._metrics.inc("energy_rows_suppressed_total", plug=plugip)
+
+			energy_state["last_row"] = current_row
+		if inserted:
+			self._metrics.inc("energy_rows_queued_total", len(inserted), plug=plugip)
+			if push:
+				self._send_energy_rows(plugip, inserted)
+
+	def _energy_totals(self, statuses):
+		# grand totals in kWh of the plugs that reported emeter data
+		totals = {}
+		for plugip, status in statuses.items():
+			realtime = self.deep_get(status, ["emeter", "get_realtime"])
+			if not realtime:
+				continue
+			if "total_wh" in realtime:
+				totals[plugip] = float(realtime["total_wh"]) / 1000
+			elif "total" in realtime:
+				totals[plugip] = float(realtime["total"])
+		return totals
+
+	def _send_energy_rows(self, plugip, rows):
+		# same row layout as getEnergyData, lets open graphs append new samples without refetching
+		self._plugin_manager.send_plugin_message(self._identifier, dict(energyData=dict(
+			ip=plugip, rows=[[row[1], row[3], row[4], row[6], row[2]] for row in rows])))
+
+	def _get_energy_state(self, plugip):
+		with self._energy_lock:
+			if plugip not in self._energy_state:
+				self._energy_state[plugip] = dict(last_row=[plugip, None, 0, 0, 0, 0, 0], last_row_entered=True,
+												  total_correction=0)
+			return self._energy_state[plugip]
+
 	def get_api_commands(self):
 		return dict(
 			turnOn=["ip"],
 			turnOff=["ip"],
 			checkStatus=["ip"],
 			getEnergyData=["ip"],
+			getEnergyRollup=["ip"],
+			liveSampling=[],
 			enableAutomaticShutdown=[],
 			disableAutomaticShutdown=[],
 			abortAutomaticShutdown=[],
@@ -629,6 +931,40 @@ class tplinksmartplugPlugin(octoprint.plugin.SettingsPlugin,
 		if request.args.get("checkStatus"):
 			response = self.check_status(request.args.get("checkStatus"))
 			return flask.jsonify(response)
+		if request.args.get("resolverStats"):
+			return flask.jsonify(self._resolver.stats())
+		if request.args.get("deviceInfo"):
+			return flask.jsonify(self._devices.get(parse_plugip(request.args.get("deviceInfo"))[0]) or {})
+		if request.args.get("liveSamples"):
+			ring = self._sample_rings.get(request.args.get("liveSamples"))
+			try:
+				since = float(request.args.get("since", 0))
+			except ValueError:
+				return flask.make_response("Invalid since, expected seconds since the epoch", 400)
+			return flask.jsonify(dict(ip=request.args.get("liveSamples"), active=self._scheduler.is_pending("sampling"),
+									  samples=ring.since(since) if ring is not None else []))
+		if request.args.get("metrics"):
+			return self._metrics_response(request.args.get("metrics"))
+		if request.args.get("pollingStats"):
+			return flask.jsonify(self._polling.stats())
+		if request.args.get("statusCacheStats"):
+			return flask.jsonify(self._status_cache.stats())
+		if request.args.get("thermalStats"):
+			return flask.jsonify(self.thermal_stats())
+		if request.args.get("scheduledActions"):
+			return flask.jsonify(dict(scheduled_actions=self._scheduler.pending()))
+
+	def _metrics_response(self, output_format):
+		for name, value in self._resolver.stats().items():
+			self._metrics.set("resolver_%s" % name, value)
+		for name, value in self._status_cache.stats().items():
+			self._metrics.set("status_cache_%s" % name, value)
+		self._metrics.set("scheduled_actions", len(self._scheduler.pending()))
+		for hook, timer in self._hook_timers.items():
+			self._metrics.merge_hook(hook, timer)
+		if output_format == "prometheus":
+			return flask.Response(self._metrics.prometheus(), mimetype="text/plain; version=0.0.4")
+		return flask.jsonify(self._metrics.snapshot())
 
 	def on_api_command(self, command, data):
 		if not Permissions.PLUGIN_TPLINKSMARTPLUG_CONTROL.can():
@@ -642,16 +978,22 @@ class tplinksmartplugPlugin(octoprint.plugin.SettingsPlugin,
 			self._plugin_manager.send_plugin_message(self._identifier, response)
 		elif command == 'checkStatus':
 			response = self.check_status("{ip}".format(**data))
+		elif command == 'getEnergyData' and data.get("buckets"):
+			response = get_energy_buckets(self.db_path, data["ip"], data["buckets"], data["range_seconds"])
+			self._tplinksmartplug_logger.debug(response)
+		elif command == 'getEnergyRollup':
+			response = get_energy_rollup(self.db_path, data["ip"], period=data.get("period", "daily"),
+										 limit=data.get("limit", 31))
+			response["cost_rate"] = self._settings.get_float(["cost_rate"])
+			self._tplinksmartplug_logger.debug(response)
 		elif command == 'getEnergyData':
-			db = sqlite3.connect(self.db_path)
-			cursor = db.cursor()
-			cursor.execute(
-				'''SELECT timestamp, current, power, grandtotal, voltage FROM energy_data WHERE ip=? ORDER BY timestamp DESC LIMIT ?,?''',
-				(data["ip"], data["record_offset"], data["record_limit"]))
-			response = {'energy_data': cursor.fetchall()}
-			db.close()
+			response = get_energy_data(self.db_path, data["ip"], data["record_limit"],
+									   record_offset=data.get("record_offset", 0), cursor=data.get("cursor"))
 			self._tplinksmartplug_logger.debug(response)
-		# SELECT * FROM energy_data WHERE ip = '192.168.0.102' LIMIT 0,30
+		elif command == 'liveSampling':
+			self._sampling_lease = monotonic_time() + 30
+			self._update_sampling()
+			response = dict(live_sampling=self._scheduler.is_pending("sampling"))
 		elif command == 'enableAutomaticShutdown':
 			self.powerOffWhenIdle = True
 			self._reset_idle_timer()
@@ -667,14 +1009,9 @@ class tplinksmartplugPlugin(octoprint.plugin.SettingsPlugin,
 				self._abort_timer.cancel()
 				self._abort_timer = None
 			self._timeout_value = None
-			for plug in self._settings.get(["arrSmartplugs"]):
+			for plug in self._plugs:
 				if plug["useCountdownRules"] and int(plug["countdownOffDelay"]) > 0:
-					if "/" in plug["ip"]:
-						plug_ip, plug_num = plug["ip"].split("/")
-					else:
-						plug_ip = plug["ip"]
-						plug_num = 0
-					self.sendCommand(json.loads('{"count_down":{"delete_all_rules":null}}'), plug_ip, plug_num)
+					self.sendCommand(json.loads('{"count_down":{"delete_all_rules":null}}'), plug.host, plug.child)
 					self._tplinksmartplug_logger.debug("Cleared countdown rules for %s" % plug["ip"])
 			self._tplinksmartplug_logger.debug("Power off aborted.")
 			self._tplinksmartplug_logger.debug("Restarting idle timer.")
@@ -701,7 +1038,7 @@ class tplinksmartplugPlugin(octoprint.plugin.SettingsPlugin,
 		# Startup Event
 		if event == Events.STARTUP and self._settings.get_boolean(["event_on_startup_monitoring"]) is True:
 			self._tplinksmartplug_logger.debug("powering on due to %s event." % event)
-			for plug in self._settings.get(['arrSmartplugs']):
+			for plug in self._plugs:
 				if plug["event_on_startup"] is True:
 					self._tplinksmartplug_logger.debug("powering on %s due to %s event." % (plug["ip"], event))
 					response = self.turn_on(plug["ip"])
@@ -710,7 +1047,7 @@ class tplinksmartplugPlugin(octoprint.plugin.SettingsPlugin,
 		# Error Event
 		if event == Events.ERROR and self._settings.get_boolean(["event_on_error_monitoring"]) is True:
 			self._tplinksmartplug_logger.debug("powering off due to %s event." % event)
-			for plug in self._settings.get(['arrSmartplugs']):
+			for plug in self._plugs:
 				if plug["event_on_error"] is True:
 					self._tplinksmartplug_logger.debug("powering off %s due to %s event." % (plug["ip"], event))
 					response = self.turn_off(plug["ip"])
@@ -730,51 +1067,53 @@ class tplinksmartplugPlugin(octoprint.plugin.SettingsPlugin,
 			self._tplinksmartplug_logger.debug("Print cancelled, resetting job_power to 0")
 			self.print_job_power = 0.0
 			self.print_job_started = False
+			self._print_job_totals = {}
 			self._autostart_file = None
 			return
 		# Print Started Event
 		if event == Events.PRINT_STARTED and self._settings.get_float(["cost_rate"]) > 0:
 			self.print_job_started = True
 			self._tplinksmartplug_logger.debug(payload.get("path", None))
-			for plug in self._settings.get(["arrSmartplugs"]):
-				status = self.check_status(plug["ip"])
-				self.print_job_power -= float(
-					self.deep_get(status, ["emeter", "get_realtime", "total_wh"], default=0)) / 1000
-				self.print_job_power -= float(self.deep_get(status, ["emeter", "get_realtime", "total"], default=0))
-				self._tplinksmartplug_logger.debug(self.print_job_power)
+			# per plug baselines, paired with the readings at print done
+			self._print_job_totals = self._energy_totals(self.check_statuses())
+			self._tplinksmartplug_logger.debug(self._print_job_totals)
 
 		if event == Events.PRINT_STARTED and self.powerOffWhenIdle is True:
 			if self._abort_timer is not None:
 				self._abort_timer.cancel()
 				self._abort_timer = None
 				self._tplinksmartplug_logger.debug("Power off aborted because starting new print.")
-			if self._idleTimer is not None:
+			if self._idle_armed:
 				self._reset_idle_timer()
 			self._timeout_value = None
 			self._plugin_manager.send_plugin_message(self._identifier,
 													 dict(powerOffWhenIdle=self.powerOffWhenIdle, type="timeout",
 														  timeout_value=self._timeout_value))
 
+		if event == Events.PRINT_STARTED and self._settings.get_boolean(["pollingEnabled"]):
+			# poll plugs at their fast interval while printing
+			self._start_polling()
+		if event == Events.PRINT_STARTED:
+			self._update_sampling()
 		if event == Events.PRINT_STARTED and self._countdown_active:
-			for plug in self._settings.get(["arrSmartplugs"]):
+			for plug in self._plugs:
 				if plug["useCountdownRules"] and int(plug["countdownOffDelay"]) > 0:
-					if "/" in plug["ip"]:
-						plug_ip, plug_num = plug["ip"].split("/")
-					else:
-						plug_ip = plug["ip"]
-						plug_num = 0
-					self.sendCommand(json.loads('{"count_down":{"delete_all_rules":null}}'), plug_ip, plug_num)
+					self.sendCommand(json.loads('{"count_down":{"delete_all_rules":null}}'), plug.host, plug.child)
 					self._tplinksmartplug_logger.debug("Cleared countdown rules for %s" % plug["ip"])
 		# Print Done Event
 		if event == Events.PRINT_DONE and self.print_job_started:
 			self._tplinksmartplug_logger.debug(payload)
 
-			for plug in self._settings.get(["arrSmartplugs"]):
-				status = self.check_status(plug["ip"])
-				self.print_job_power += float(
-					self.deep_get(status, ["emeter", "get_realtime", "total_wh"], default=0)) / 1000
-				self.print_job_power += float(self.deep_get(status, ["emeter", "get_realtime", "total"], default=0))
-				self._tplinksmartplug_logger.debug(self.print_job_power)
+			totals = self._energy_totals(self.check_statuses())
+			for plugip, start_total in self._print_job_totals.items():
+				if plugip not in totals:
+					# a plug missing at either end would add or subtract its lifetime total
+					self._tplinksmartplug_logger.debug("Skipping %s in print power, no reading at print done." % plugip)
+					continue
+				self.print_job_power += totals[plugip] - start_total
+			for plugip in set(totals) - set(self._print_job_totals):
+				self._tplinksmartplug_logger.debug("Skipping %s in print power, no reading at print start." % plugip)
+			self._tplinksmartplug_logger.debug(self.print_job_power)
 
 			hours = (payload.get("time", 0) / 60) / 60
 			self._tplinksmartplug_logger.debug("hours: %s" % hours)
@@ -789,6 +1128,7 @@ class tplinksmartplugPlugin(octoprint.plugin.SettingsPlugin,
 
 			self.print_job_power = 0.0
 			self.print_job_started = False
+			self._print_job_totals = {}
 			self._autostart_file = None
 
 		if event == Events.PRINT_DONE and len(self.power_off_queue) > 0:
@@ -809,7 +1149,7 @@ class tplinksmartplugPlugin(octoprint.plugin.SettingsPlugin,
 		# Printer Connected Event
 		if event == Events.CONNECTED:
 			if self._gcode_queued:
-				for plug in self._settings.get(['arrSmartplugs']):
+				for plug in self._plugs:
 					if plug["gcodeCmdOn"] and plug["gcodeRunCmdOn"] != "":
 						self._tplinksmartplug_logger.debug("sending gcode commands to printer.")
 						self._printer.commands(plug["gcodeRunCmdOn"].split("\n"))
@@ -825,7 +1165,7 @@ class tplinksmartplugPlugin(octoprint.plugin.SettingsPlugin,
 				self._tplinksmartplug_logger.debug(
 					"File uploaded: %s. Turning enabled plugs on." % payload.get("name", ""))
 				self._tplinksmartplug_logger.debug(payload)
-				for plug in self._settings.get(['arrSmartplugs']):
+				for plug in self._plugs:
 					self._tplinksmartplug_logger.debug(plug)
 					if plug["event_on_upload"] is True and self._printer.is_closed_or_error():
 						self._tplinksmartplug_logger.debug("powering on %s due to %s event." % (plug["ip"], event))
@@ -839,7 +1179,7 @@ class tplinksmartplugPlugin(octoprint.plugin.SettingsPlugin,
 								self._autostart_file = payload.get("path")
 		# Shutdown Event
 		if event == Events.SHUTDOWN and self._settings.get_boolean(["event_on_shutdown_monitoring"]):
-			for plug in self._settings.get(['arrSmartplugs']):
+			for plug in self._plugs:
 				if plug["event_on_shutdown"] is True:
 					self._tplinksmartplug_logger.debug("powering off %s due to shutdown event." % plug["ip"])
 					self.turn_off(plug["ip"])
@@ -850,24 +1190,31 @@ class tplinksmartplugPlugin(octoprint.plugin.SettingsPlugin,
 		self._stop_idle_timer()
 
 		if self.powerOffWhenIdle:
-			self._idleTimer = ResettableTimer(self.idleTimeout * 60, self._idle_poweroff)
-			self._idleTimer.daemon = True
-			self._idleTimer.start()
+			self._idle_last_activity = monotonic_time()
+			self._idle_armed = True
+			self._scheduler.schedule(self.idleTimeout * 60, self._idle_check, key="idle", blocking=True)
 
 	def _stop_idle_timer(self):
-		if self._idleTimer:
-			self._idleTimer.cancel()
-			self._idleTimer = None
+		self._idle_armed = False
+		self._scheduler.cancel("idle")
 
 	def _reset_idle_timer(self):
-		try:
-			if self._idleTimer.is_alive():
-				self._idleTimer.reset()
-			else:
-				raise Exception()
-		except:
+		if self._idle_armed:
+			self._idle_last_activity = monotonic_time()
+		else:
 			self._start_idle_timer()
 
+	def _idle_check(self):
+		# activity only moves the deadline forward, so checking again at the last known deadline is enough
+		if not self._idle_armed:
+			return
+		remaining = self._idle_last_activity + self.idleTimeout * 60 - monotonic_time()
+		if remaining > 0:
+			self._scheduler.schedule(remaining, self._idle_check, key="idle", blocking=True)
+			return
+		self._idle_armed = False
+		self._idle_poweroff()
+
 	def _idle_poweroff(self):
 		if not self.powerOffWhenIdle:
 			return
@@ -992,8 +1339,7 @@ class tplinksmartplugPlugin(octoprint.plugin.SettingsPlugin,
 		self._tplinksmartplug_logger.debug("Starting abort power off timer.")
 
 		self._timeout_value = self.abortTimeout
-		self._abort_timer = RepeatedTimer(1, self._timer_task)
-		self._abort_timer.start()
+		self._abort_timer = self._scheduler.schedule_repeating(1, self._timer_task, key="abort_power_off")
 
 	def _timer_task(self):
 		if self._timeout_value is None:
@@ -1007,11 +1353,12 @@ class tplinksmartplugPlugin(octoprint.plugin.SettingsPlugin,
 			if self._abort_timer is not None:
 				self._abort_timer.cancel()
 				self._abort_timer = None
-			self._shutdown_system()
+			# powering off talks to the plugs, keep it off the pool the countdown ticks run on
+			self._scheduler.schedule(0, self._shutdown_system, key="shutdown_system", blocking=True)
 
 	def _shutdown_system(self):
 		self._tplinksmartplug_logger.debug("Automatically powering off enabled plugs.")
-		for plug in self._settings.get(['arrSmartplugs']):
+		for plug in self._plugs:
 			if plug.get("automaticShutdownEnabled", False):
 				response = self.turn_off("{ip}".format(**plug))
 				self._plugin_manager.send_plugin_message(self._identifier, response)
@@ -1020,21 +1367,14 @@ class tplinksmartplugPlugin(octoprint.plugin.SettingsPlugin,
 	##~~ Utilities
 
 	def _get_device_id(self, plugip):
-		response = self._settings.get([plugip])
+		plug_ip, plug_num = parse_plugip(plugip)
+		response = self._devices.child_id(plug_ip, plug_num) if plug_num else self._devices.device_id(plug_ip)
 		if not response:
 			check_status_cmnd = dict(system=dict(get_sysinfo=dict()))
-			plug_ip = plugip.split("/")
 			self._tplinksmartplug_logger.debug(check_status_cmnd)
-			plug_data = self.sendCommand(check_status_cmnd, plug_ip[0])
-			if len(plug_ip) == 2:
-				response = self.deep_get(plug_data, ["system", "get_sysinfo", "children"], default=False)
-				if response:
-					response = response[int(plug_ip[1]) - 1]["id"]
-			else:
-				response = self.deep_get(response, ["system", "get_sysinfo", "deviceId"])
-			if response:
-				self._settings.set([plugip], response)
-				self._settings.save()
+			plug_data = self.sendCommand(check_status_cmnd, plug_ip)
+			self._devices.update_from_sysinfo(plug_ip, self.deep_get(plug_data, ["system", "get_sysinfo"]))
+			response = self._devices.child_id(plug_ip, plug_num) if plug_num else self._devices.device_id(plug_ip)
 		self._tplinksmartplug_logger.debug("get_device_id response: %s" % response)
 		return response
 
@@ -1058,28 +1398,15 @@ class tplinksmartplugPlugin(octoprint.plugin.SettingsPlugin,
 			return self.lookup(dic.get(key, {}), *keys)
 		return dic.get(key)
 
-	def plug_search(self, list, key, value):
-		for item in list:
-			if item[key] == value.strip():
-				return item
-
 	def encrypt(self, string):
-		key = 171
-		result = b"\0\0\0" + bytes([len(string)])
-		for i in bytes(string.encode('latin-1')):
-			a = key ^ i
-			key = a
-			result += bytes([a])
-		return result
+		return encrypt(string)
 
 	def decrypt(self, string):
-		key = 171
-		result = b""
-		for i in bytes(string):
-			a = key ^ i
-			key = i
-			result += bytes([a])
-		return result.decode('latin-1')
+		return decrypt(string)
+
+	def sendCommands(self, cmds, plugip, plug_num=0):
+		response = self.sendCommand(merge_commands(cmds), plugip, plug_num)
+		return split_response(response, cmds)
 
 	def sendCommand(self, cmd, plugip, plug_num=0):
 		commands = {'info': '{"system":{"get_sysinfo":{}}}',
@@ -1100,44 +1427,59 @@ class tplinksmartplugPlugin(octoprint.plugin.SettingsPlugin,
 		try:
 			socket.inet_aton(plugip)
 			ip = plugip
+			is_hostname = False
 			self._tplinksmartplug_logger.debug("IP %s is valid." % plugip)
 		except socket.error:
 			# try to convert hostname to ip
 			self._tplinksmartplug_logger.debug("Invalid ip %s trying hostname." % plugip)
-			try:
-				ip = socket.gethostbyname(plugip)
-				self._tplinksmartplug_logger.debug("Hostname %s is valid." % plugip)
-			except (socket.herror, socket.gaierror):
+			with self._metrics.timed("dns_lookup_seconds"):
+				ip = self._resolver.resolve(plugip)
+			is_hostname = True
+			if ip is None:
 				self._tplinksmartplug_logger.debug("Invalid hostname %s." % plugip)
+				self._metrics.inc("dns_failures_total", plug=plugip)
 				return {"system": {"get_sysinfo": {"relay_state": 3}}, "emeter": {"err_code": True}}
+			self._tplinksmartplug_logger.debug("Hostname %s is valid." % plugip)
 
 		if int(plug_num) >= 1:
 			plug_ip_num = "{}/{}".format(plugip, int(plug_num))
 			cmd["context"] = dict(child_ids=[self._get_device_id(plug_ip_num)])
 
+		plug_label = "{}/{}".format(plugip, int(plug_num)) if int(plug_num) >= 1 else plugip
+		start = time.time()
 		try:
 			self._tplinksmartplug_logger.debug("Sending command %s to %s" % (cmd, plugip))
-			sock_tcp = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-			sock_tcp.connect((ip, 9999))
-			sock_tcp.send(self.encrypt(json.dumps(cmd)))
-			data = sock_tcp.recv(1024)
-			len_data = unpack('>I', data[0:4])
-			while (len(data) - 4) < len_data[0]:
-				data = data + sock_tcp.recv(1024)
-			sock_tcp.close()
-
-			self._tplinksmartplug_logger.debug(self.decrypt(data))
-			return json.loads(self.decrypt(data[4:]))
+			try:
+				data = self._connection_pool.request(ip, self.encrypt(json.dumps(cmd)))
+			except socket.error:
+				if not is_hostname:
+					raise
+				# the plug may have moved to a new address, re-resolve right away and retry once if it did
+				self._resolver.invalidate(plugip)
+				new_ip = self._resolver.resolve(plugip)
+				if new_ip is None or new_ip == ip:
+					raise
+				self._tplinksmartplug_logger.debug("Hostname %s moved from %s to %s." % (plugip, ip, new_ip))
+				self._connection_pool.discard(ip)
+				data = self._connection_pool.request(new_ip, self.encrypt(json.dumps(cmd)))
+			self._metrics.observe("plug_request_seconds", time.time() - start, plug=plug_label)
+			with self._metrics.timed("decrypt_seconds"):
+				data = self.decrypt(data)
+			self._tplinksmartplug_logger.debug(data)
+			return json.loads(data)
+		except socket.timeout:
+			self._tplinksmartplug_logger.debug("Timed out talking to %s." % plugip)
+			self._metrics.inc("plug_timeouts_total", plug=plug_label)
+			return {"system": {"get_sysinfo": {"relay_state": 3}}, "emeter": {"err_code": True}}
 		except socket.error:
 			self._tplinksmartplug_logger.debug("Could not connect to %s." % plugip)
+			self._metrics.inc("plug_connection_errors_total", plug=plug_label)
 			return {"system": {"get_sysinfo": {"relay_state": 3}}, "emeter": {"err_code": True}}
 
 	##~~ Gcode processing hook
 
 	def gcode_turn_off(self, plug):
-		if plug["ip"] in self.active_timers["off"]:
-			self.active_timers["off"][plug["ip"]].cancel()
-			del self.active_timers["off"][plug["ip"]]
+		self._scheduler.cancel((plug["ip"], "gcodeOff"))
 
 		if self._printer.is_printing() and plug["warnPrinting"] is True:
 			self._tplinksmartplug_logger.debug(
@@ -1149,68 +1491,69 @@ class tplinksmartplugPlugin(octoprint.plugin.SettingsPlugin,
 
 
 	def gcode_turn_on(self, plug):
-		if plug["ip"] in self.active_timers["on"]:
-			self.active_timers["on"][plug["ip"]].cancel()
-			del self.active_timers["on"][plug["ip"]]
+		self._scheduler.cancel((plug["ip"], "gcodeOn"))
 
 		chk = self.turn_on(plug["ip"])
 		self._plugin_manager.send_plugin_message(self._identifier, chk)
 
 	def processGCODE(self, comm_instance, phase, cmd, cmd_type, gcode, *args, **kwargs):
-		if self.powerOffWhenIdle and not (gcode in self._idleIgnoreCommandsArray):
+		start = monotonic_time()
+		if self.powerOffWhenIdle and gcode not in self._idleIgnoreCommandsArray:
+			# plain attribute writes only, the scheduled idle check picks up the new deadline
 			self._waitForHeaters = False
-			self._reset_idle_timer()
+			self._idle_last_activity = start
+			if not self._idle_armed:
+				self._start_idle_timer()
 
-		if gcode not in ["M80", "M81"]:
-			return
+		if gcode in POWER_GCODES:
+			self._process_power_gcode(cmd, gcode)
+		self._hook_timers["gcode_queuing"].add(monotonic_time() - start)
 
+	def _process_power_gcode(self, cmd, gcode):
 		if gcode == "M80":
 			plugip = re.sub(r'^M80\s?', '', cmd)
 			self._tplinksmartplug_logger.debug("Received M80 command, attempting power on of %s." % plugip)
-			plug = self.plug_search(self._settings.get(["arrSmartplugs"]), "ip", plugip)
+			plug = self._plugs.find(plugip)
 			self._tplinksmartplug_logger.debug(plug)
 			if plug and plug["gcodeEnabled"]:
-				t = threading.Timer(int(plug["gcodeOnDelay"]), self.gcode_turn_on, [plug])
-				t.daemon = True
-				t.start()
+				self._scheduler.schedule(int(plug["gcodeOnDelay"]), self.gcode_turn_on, [plug],
+										 key=(plug.ip, "gcodeOn"), blocking=True)
 			return
 		if gcode == "M81":
 			plugip = re.sub(r'^M81\s?', '', cmd)
 			self._tplinksmartplug_logger.debug("Received M81 command, attempting power off of %s." % plugip)
-			plug = self.plug_search(self._settings.get(["arrSmartplugs"]), "ip", plugip)
+			plug = self._plugs.find(plugip)
 			self._tplinksmartplug_logger.debug(plug)
 			if plug and plug["gcodeEnabled"]:
-				t = threading.Timer(int(plug["gcodeOffDelay"]), self.gcode_turn_off, [plug])
-				t.daemon = True
-				t.start()
+				self._scheduler.schedule(int(plug["gcodeOffDelay"]), self.gcode_turn_off, [plug],
+										 key=(plug.ip, "gcodeOff"), blocking=True)
 			return
 
 	def processAtCommand(self, comm_instance, phase, command, parameters, tags=None, *args, **kwargs):
+		start = monotonic_time()
+		self._process_at_command(command, parameters)
+		self._hook_timers["atcommand_sending"].add(monotonic_time() - start)
+
+	def _process_at_command(self, command, parameters):
 		if command == "TPLINKON":
 			plugip = parameters
 			self._tplinksmartplug_logger.debug("Received TPLINKON command, attempting power on of %s." % plugip)
-			plug = self.plug_search(self._settings.get(["arrSmartplugs"]), "ip", plugip)
+			plug = self._plugs.find(plugip)
 			self._tplinksmartplug_logger.debug(plug)
 			if plug and plug["gcodeEnabled"]:
-				if plugip in self.active_timers["off"]:
-					self.active_timers["off"][plugip].cancel()
-					del self.active_timers["off"][plugip]
-				self.active_timers["on"][plugip] = threading.Timer(int(plug["gcodeOnDelay"]), self.gcode_turn_on, [plug])
-				self.active_timers["on"][plugip].daemon = True
-				self.active_timers["on"][plugip].start()
+				self._scheduler.cancel((plug.ip, "gcodeOff"))
+				self._scheduler.schedule(int(plug["gcodeOnDelay"]), self.gcode_turn_on, [plug],
+										 key=(plug.ip, "gcodeOn"), blocking=True)
 			return None
 		if command == "TPLINKOFF":
 			plugip = parameters
 			self._tplinksmartplug_logger.debug("Received TPLINKOFF command, attempting power off of %s." % plugip)
-			plug = self.plug_search(self._settings.get(["arrSmartplugs"]), "ip", plugip)
+			plug = self._plugs.find(plugip)
 			self._tplinksmartplug_logger.debug(plug)
 			if plug and plug["gcodeEnabled"]:
-				if plugip in self.active_timers["on"]:
-					self.active_timers["on"][plugip].cancel()
-					del self.active_timers["on"][plugip]
-				self.active_timers["off"][plugip] = threading.Timer(int(plug["gcodeOffDelay"]), self.gcode_turn_off, [plug])
-				self.active_timers["off"][plugip].daemon = True
-				self.active_timers["off"][plugip].start()
+				self._scheduler.cancel((plug.ip, "gcodeOn"))
+				self._scheduler.schedule(int(plug["gcodeOffDelay"]), self.gcode_turn_off, [plug],
+										 key=(plug.ip, "gcodeOff"), blocking=True)
 			return None
 		if command == 'TPLINKIDLEON':
 			self.powerOffWhenIdle = True
@@ -1229,30 +1572,67 @@ class tplinksmartplugPlugin(octoprint.plugin.SettingsPlugin,
 
 	##~~ Temperatures received hook
 
+	def _refresh_thermal_settings(self):
+		self._thermal_monitoring = self._settings.get_boolean(["thermal_runaway_monitoring"])
+		self._thermal_max_bed = int(self._settings.get(["thermal_runaway_max_bed"]))
+		self._thermal_max_extruder = int(self._settings.get(["thermal_runaway_max_extruder"]))
+		self._thermal_plugs = [plug.ip for plug in self._plugs if plug.get("thermal_runaway")]
+
 	def check_temps(self, parsed_temps):
 		thermal_runaway_triggered = False
 		for k, v in list(parsed_temps.items()):
-			if k == "B" and v[0] > int(self._settings.get(["thermal_runaway_max_bed"])):
+			if v[0] is None:
+				continue
+			if k == "B" and v[0] > self._thermal_max_bed:
 				self._tplinksmartplug_logger.debug("Max bed temp reached, shutting off plugs.")
 				thermal_runaway_triggered = True
-			if k.startswith("T") and v[0] > int(self._settings.get(["thermal_runaway_max_extruder"])):
+			if k.startswith("T") and v[0] > self._thermal_max_extruder:
 				self._tplinksmartplug_logger.debug("Extruder max temp reached, shutting off plugs.")
 				thermal_runaway_triggered = True
-			if thermal_runaway_triggered == True:
-				for plug in self._settings.get(['arrSmartplugs']):
-					if plug["thermal_runaway"] == True:
-						response = self.turn_off(plug["ip"])
-						if response["currentState"] == "off":
+		return thermal_runaway_triggered
+
+	def _thermal_monitor_loop(self):
+		# only the latest report matters, reports arriving while a check runs are coalesced into the next one
+		while True:
+			self._thermal_wakeup.wait()
+			self._thermal_wakeup.clear()
+			try:
+				thermal_runaway_triggered = self.check_temps(self._thermal_latest)
+				if thermal_runaway_triggered:
+					# a plug only counts as tripped once it reports off, the others are retried on every report
+					pending = [plugip for plugip in self._thermal_plugs if plugip not in self._thermal_tripped]
+					if pending:
+						self._tplinksmartplug_logger.info("Thermal runaway detected, powering off %s." % ", ".join(pending))
+					for plugip in pending:
+						try:
+							response = self.turn_off(plugip)
+						except Exception:
+							self._tplinksmartplug_logger.exception("Thermal runaway power off of %s failed." % plugip)
+							continue
+						if response is not None and response.get("currentState") == "off":
+							self._thermal_tripped.add(plugip)
 							self._plugin_manager.send_plugin_message(self._identifier, response)
+						else:
+							self._tplinksmartplug_logger.warning("Thermal runaway power off of %s failed, retrying on the next report." % plugip)
+				elif self._thermal_tripped:
+					self._tplinksmartplug_logger.info("Temperatures back below thermal runaway limits.")
+					self._thermal_tripped = set()
+			except Exception:
+				self._tplinksmartplug_logger.exception("Thermal runaway check failed.")
 
 	def monitor_temperatures(self, comm, parsed_temps):
-		if self._settings.get(["thermal_runaway_monitoring"]):
-			# Run inside it's own thread to prevent communication blocking
-			t = threading.Timer(0, self.check_temps, [parsed_temps])
-			t.daemon = True
-			t.start()
+		if self._thermal_monitoring:
+			start = monotonic_time()
+			self._thermal_latest = parsed_temps
+			self._thermal_wakeup.set()
+			self._hook_timers["temperatures_received"].add(monotonic_time() - start)
 		return parsed_temps
 
+	def thermal_stats(self):
+		hook = self._hook_timers["temperatures_received"].snapshot()
+		return dict(hook_calls=hook["calls"], hook_time=hook["seconds"], hook_avg_time=hook["avg"],
+					tripped=sorted(self._thermal_tripped))
+
 	##~~ Access Permissions Hook
 
 	def get_additional_permissions(self, *args, **kwargs):
@@ -0,0 +1,125 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import io
+import json
+import logging
+import os
+import threading
+
+# os.replace is atomic on Python 3, Python 2 only has rename
+_replace = getattr(os, "replace", os.rename)
+
+
+def normalize_mac(mac):
+	mac = (mac or "").replace(":", "").replace("-", "").upper()
+	return mac or None
+
+
+class DeviceCache(object):
+	"""
+	Capabilities of the devices behind the configured plugs, keyed by host.
+
+	Every entry holds the model, feature flags, emeter unit style ("mW" for
+	the ``*_mw`` keys of newer firmware, "W" for the plain ones), child ids,
+	firmware and hardware version, mac address and device id. Entries are
+	learned from the sysinfo responses that status checks receive anyway and
+	only change, and are written to ``path``, when a response no longer
+	matches them. Unchanged responses cost a dict comparison.
+	"""
+
+	def __init__(self, logger=None):
+		self.path = None
+		self._logger = logger or logging.getLogger("octoprint.plugins.tplinksmartplug.debug")
+		self._lock = threading.Lock()
+		self._devices = {}
+
+	def load(self, path):
+		self.path = path
+		if not os.path.exists(path):
+			return
+		try:
+			with io.open(path, "r", encoding="utf-8") as f:
+				devices = json.load(f)
+		except (IOError, OSError, ValueError):
+			self._logger.exception("Could not load device cache from %s." % path)
+			return
+		with self._lock:
+			self._devices = dict((host, device) for host, device in devices.items() if isinstance(device, dict))
+
+	def get(self, host):
+		return self._devices.get(host)
+
+	def has_emeter(self, host):
+		device = self._devices.get(host)
+		return device is not None and "ENE" in device.get("feature", "")
+
+	def device_id(self, host):
+		device = self._devices.get(host)
+		return device.get("device_id") if device else None
+
+	def child_id(self, host, child):
+		device = self._devices.get(host)
+		if device is None or not 1 <= child <= len(device.get("child_ids", [])):
+			return None
+		return device["child_ids"][child - 1]
+
+	def host_for_mac(self, mac):
+		mac = normalize_mac(mac)
+		for host, device in list(self._devices.items()):
+			if mac and device.get("mac") == mac:
+				return host
+		return None
+
+	def update_from_sysinfo(self, host, sysinfo):
+		if not isinstance(sysinfo, dict) or not (sysinfo.get("deviceId") or sysinfo.get("model")):
+			return False
+		learned = dict(model=sysinfo.get("model"), feature=sysinfo.get("feature", ""),
+					   sw_ver=sysinfo.get("sw_ver"), hw_ver=sysinfo.get("hw_ver"),
+					   mac=normalize_mac(sysinfo.get("mac") or sysinfo.get("mic_mac")),
+					   device_id=sysinfo.get("deviceId"),
+					   child_ids=[child.get("id") for child in sysinfo.get("children", [])])
+		with self._lock:
+			device = self._devices.get(host, {})
+			if device.get("device_id") == learned["device_id"]:
+				# emeter units are learned from emeter responses and survive sysinfo updates of the same device
+				learned["emeter_units"] = device.get("emeter_units")
+			else:
+				learned["emeter_units"] = None
+			if device == learned:
+				return False
+			self._devices[host] = learned
+		self._logger.debug("Learned capabilities of %s: %s" % (host, learned))
+		self.save()
+		return True
+
+	def update_emeter_units(self, host, realtime):
+		units = "mW" if "power_mw" in realtime else "W" if "power" in realtime else None
+		with self._lock:
+			device = self._devices.get(host)
+			if device is None or units is None or device.get("emeter_units") == units:
+				return False
+			device["emeter_units"] = units
+		self.save()
+		return True
+
+	def invalidate(self, host=None):
+		with self._lock:
+			if host is None:
+				self._devices.clear()
+			else:
+				self._devices.pop(host, None)
+		self.save()
+
+	def save(self):
+		if self.path is None:
+			return
+		with self._lock:
+			data = json.dumps(self._devices, indent=2, sort_keys=True)
+		tmp_path = self.path + ".tmp"
+		try:
+			with io.open(tmp_path, "w", encoding="utf-8") as f:
+				f.write(u"%s" % data)
+			_replace(tmp_path, self.path)
+		except (IOError, OSError):
+			self._logger.exception("Could not save device cache to %s." % self.path)
@@ -0,0 +1,309 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import logging
+import sqlite3
+import threading
+import time
+
+from datetime import datetime, timedelta
+
+try:
+	import queue
+except ImportError:
+	import Queue as queue
+
+INSERT_ENERGY_DATA = '''INSERT INTO energy_data(ip, timestamp, voltage, current, power, total, grandtotal) VALUES(?,?,?,?,?,?,?)'''
+
+# rollup table name, the length of the timestamp prefix that identifies its period and the period length in hours
+ROLLUPS = (("energy_rollup_hourly", 13, 1), ("energy_rollup_daily", 10, 24))
+
+
+def create_rollup_tables(db):
+	"""
+	Create the hourly and daily rollup tables, backfilling them from ``energy_data`` when they are new.
+	"""
+	for table, prefix, hours in ROLLUPS:
+		exists = db.execute('''SELECT name FROM sqlite_master WHERE type='table' AND name=?''', (table,)).fetchone()
+		if exists:
+			continue
+		db.execute('''CREATE TABLE %s (ip TEXT, period TEXT, energy REAL, peak_power REAL, avg_power REAL,
+			samples INTEGER, last_grandtotal REAL, PRIMARY KEY (ip, period))''' % table)
+		db.execute('''INSERT INTO %s (ip, period, energy, peak_power, avg_power, samples, last_grandtotal)
+			SELECT ip, substr(timestamp, 1, %d), SUM(MAX(delta, 0)), MAX(power), SUM(MAX(delta, 0)) * 1000 / %d, COUNT(*),
+				MAX(grandtotal) FROM
+				(SELECT ip, timestamp, power, grandtotal,
+					grandtotal - COALESCE(LAG(grandtotal, 1) OVER (PARTITION BY ip ORDER BY timestamp, id), grandtotal) AS delta
+					FROM energy_data)
+			GROUP BY ip, substr(timestamp, 1, %d)''' % (table, prefix, hours, prefix))
+	db.commit()
+
+
+class EnergyDataWriter(object):
+	"""
+	Single long-lived writer for the ``energy_data`` table.
+
+	Rows are queued by ``insert`` and written by a background thread owning
+	one WAL mode connection, in one transaction per batch of ``batch_size``
+	rows or every ``flush_interval`` seconds, whichever comes first. WAL mode
+	lets readers on their own connections run while a batch is committed.
+
+	The same transaction keeps the hourly and daily rollup tables up to date.
+	With ``retention_days`` set, raw rows older than that are pruned every
+	``prune_interval`` seconds, keeping the newest row of every plug so
+	grandtotal bookkeeping survives a restart.
+	"""
+
+	def __init__(self, db_path, batch_size=50, flush_interval=10, retention_days=0, prune_interval=3600, logger=None,
+				 metrics=None):
+		self.db_path = db_path
+		self.batch_size = batch_size
+		self.flush_interval = flush_interval
+		self.retention_days = retention_days
+		self.prune_interval = prune_interval
+		self._logger = logger or logging.getLogger("octoprint.plugins.tplinksmartplug.debug")
+		self._metrics = metrics
+		self._queue = queue.Queue()
+		self._thread = None
+		self._stop = object()
+		self._last_grandtotal = {}
+		self.rows_written = 0
+		self.commits = 0
+
+	def start(self):
+		if self._thread is not None:
+			return
+		self._thread = threading.Thread(target=self._run)
+		self._thread.daemon = True
+		self._thread.start()
+
+	def stop(self, timeout=10):
+		if self._thread is None:
+			return
+		self._queue.put(self._stop)
+		self._thread.join(timeout)
+		self._thread = None
+
+	def insert(self, row):
+		self._queue.put(tuple(row))
+
+	def flush(self, timeout=5):
+		if self._thread is None:
+			return
+		flushed = threading.Event()
+		self._queue.put(flushed)
+		flushed.wait(timeout)
+
+	def _run(self):
+		db = sqlite3.connect(self.db_path)
+		db.execute('''PRAGMA journal_mode=WAL''')
+		db.execute('''PRAGMA synchronous=NORMAL''')
+		self._last_grandtotal = dict(db.execute('''SELECT ip, grandtotal FROM energy_data
+			WHERE id IN (SELECT MAX(id) FROM energy_data GROUP BY ip)''').fetchall())
+		pending = []
+		deadline = None
+		next_prune = time.time()
+		try:
+			while True:
+				if time.time() >= next_prune:
+					self._prune(db)
+					next_prune = time.time() + self.prune_interval
+				wake = next_prune if deadline is None else min(deadline, next_prune)
+				try:
+					item = self._queue.get(timeout=max(wake - time.time(), 0))
+				except queue.Empty:
+					item = None
+
+				if isinstance(item, tuple):
+					pending.append(item)
+					if deadline is None:
+						deadline = time.time() + self.flush_interval
+					if len(pending) < self.batch_size:
+						continue
+				elif item is None and (deadline is None or time.time() < deadline):
+					# woken up for pruning only
+					continue
+
+				self._write(db, pending)
+				pending = []
+				deadline = None
+
+				if item is self._stop:
+					# drain whatever was queued behind the stop marker
+					while True:
+						try:
+							item = self._queue.get_nowait()
+						except queue.Empty:
+							break
+						if isinstance(item, tuple):
+							pending.append(item)
+						elif isinstance(item, threading.Event):
+							item.set()
+					self._write(db, pending)
+					return
+				if isinstance(item, threading.Event):
+					item.set()
+		finally:
+			db.close()
+
+	def _write(self, db, rows):
+		if not rows:
+			return
+		last_grandtotal = dict(self._last_grandtotal)
+		try:
+			start = time.time()
+			with db:
+				db.executemany(INSERT_ENERGY_DATA, rows)
+				for ip, timestamp, voltage, current, power, total, grandtotal in rows:
+					energy = max(grandtotal - last_grandtotal.get(ip, grandtotal), 0)
+					last_grandtotal[ip] = grandtotal
+					for table, prefix, hours in ROLLUPS:
+						period = timestamp[:prefix]
+						db.execute('''INSERT OR IGNORE INTO %s (ip, period, energy, peak_power, avg_power, samples, last_grandtotal)
+							VALUES (?, ?, 0, 0, 0, 0, ?)''' % table, (ip, period, grandtotal))
+						# rows are spaced unevenly, so average power comes from the energy used rather than from the samples
+						db.execute('''UPDATE %s SET energy = energy + ?, peak_power = MAX(peak_power, ?),
+							avg_power = (energy + ?) * 1000 / ?, samples = samples + 1, last_grandtotal = ?
+							WHERE ip = ? AND period = ?''' % table, (energy, power, energy, hours, grandtotal, ip, period))
+				inserted = time.time()
+			self._last_grandtotal = last_grandtotal
+			self.rows_written += len(rows)
+			self.commits += 1
+			if self._metrics is not None:
+				self._metrics.observe("db_insert_seconds", inserted - start)
+				self._metrics.observe("db_commit_seconds", time.time() - inserted)
+				self._metrics.inc("energy_rows_written_total", len(rows))
+			self._logger.debug("Wrote %s energy data row(s)." % len(rows))
+		except sqlite3.Error:
+			self._logger.exception("Could not write %s energy data row(s)." % len(rows))
+			if self._metrics is not None:
+				self._metrics.inc("db_write_errors_total")
+
+	def _prune(self, db):
+		if not self.retention_days:
+			return
+		cutoff = (datetime.today() - timedelta(days=self.retention_days)).isoformat(' ')
+		try:
+			with db:
+				# rollups are written in the same transaction as the raw rows, so anything older is already rolled up
+				pruned = 0
+				for ip, in db.execute('''SELECT DISTINCT ip FROM energy_rollup_daily''').fetchall():
+					pruned += db.execute('''DELETE FROM energy_data WHERE ip = ? AND timestamp < ?
+						AND id < (SELECT MAX(id) FROM energy_data WHERE ip = ?)''', (ip, cutoff, ip)).rowcount
+			if pruned:
+				self._logger.debug("Pruned %s energy data row(s) older than %s day(s)." % (pruned, self.retention_days))
+		except sqlite3.Error:
+			self._logger.exception("Could not prune energy data.")
+
+
+def get_energy_data(db_path, ip, record_limit, record_offset=0, cursor=None):
+	"""
+	Newest first energy data rows for a plug.
+
+	Without ``cursor`` this pages by ``record_offset``. Passing the
+	``next_cursor`` of the previous response (``{"timestamp": ..., "id": ...}``)
+	continues right after that row instead. The ``timestamp <=`` bound lets
+	the (ip, timestamp) index seek straight to the cursor, so deep history
+	pages cost the same as the first one.
+	"""
+	db = sqlite3.connect(db_path)
+	try:
+		if cursor:
+			rows = db.execute(
+				'''SELECT timestamp, current, power, grandtotal, voltage, id FROM energy_data WHERE ip=?
+					AND timestamp <= ? AND (timestamp < ? OR id < ?) ORDER BY timestamp DESC, id DESC LIMIT ?''',
+				(ip, cursor["timestamp"], cursor["timestamp"], cursor["id"], record_limit)).fetchall()
+		else:
+			rows = db.execute(
+				'''SELECT timestamp, current, power, grandtotal, voltage, id FROM energy_data WHERE ip=?
+					ORDER BY timestamp DESC, id DESC LIMIT ?,?''',
+				(ip, record_offset, record_limit)).fetchall()
+	finally:
+		db.close()
+	next_cursor = dict(timestamp=rows[-1][0], id=rows[-1][5]) if rows else None
+	return {'energy_data': [row[:5] for row in rows], 'next_cursor': next_cursor}
+
+
+def get_energy_buckets(db_path, ip, buckets, range_seconds, end=None):
+	"""
+	Energy data for a plug over the last ``range_seconds`` up to ``end``, downsampled to at most ``buckets`` rows.
+
+	Each row starts like a raw ``get_energy_data`` row with averages,
+	``[timestamp, current, power, grandtotal, voltage]``, where grandtotal is
+	the last value in the bucket, followed by ``min current, max current,
+	min power, max power, min voltage, max voltage, samples``. Rows are
+	returned newest first like the raw query.
+
+	Buckets of an hour or longer are built from the hourly rollups instead
+	of raw rows, so they also cover pruned history. Those only track power,
+	so current, voltage and min power are None and power is the average
+	derived from the energy used in the bucket.
+	"""
+	if end is None:
+		end = datetime.today()
+	buckets = max(int(buckets), 1)
+	start = end - timedelta(seconds=int(range_seconds))
+	width = max(float(range_seconds) / buckets, 1.0)
+	if width >= 3600:
+		return _get_rollup_buckets(db_path, ip, start, end, width)
+	db = sqlite3.connect(db_path)
+	try:
+		rows = db.execute(
+			'''SELECT CAST((julianday(timestamp) - julianday(?)) * 86400.0 / ? AS INTEGER) AS bucket,
+				AVG(current), AVG(power), MAX(grandtotal), AVG(voltage),
+				MIN(current), MAX(current), MIN(power), MAX(power), MIN(voltage), MAX(voltage), COUNT(*)
+				FROM energy_data WHERE ip=? AND timestamp >= ? AND timestamp < ?
+				GROUP BY bucket ORDER BY bucket DESC''',
+			(start.isoformat(' '), width, ip, start.isoformat(' '), end.isoformat(' '))).fetchall()
+	finally:
+		db.close()
+	return {'energy_data': [[(start + timedelta(seconds=row[0] * width)).isoformat(' ')] + list(row[1:]) for row in rows],
+			'bucket_seconds': width}
+
+
+def _get_rollup_buckets(db_path, ip, start, end, width):
+	db = sqlite3.connect(db_path)
+	try:
+		rows = db.execute(
+			'''SELECT CAST((julianday(period || ':00:00') - julianday(?)) * 86400.0 / ? AS INTEGER) AS bucket,
+				NULL, SUM(energy), MAX(last_grandtotal), NULL,
+				NULL, NULL, NULL, MAX(peak_power), NULL, NULL, SUM(samples)
+				FROM energy_rollup_hourly WHERE ip=? AND period >= ? AND period <= ?
+				GROUP BY bucket ORDER BY bucket DESC''',
+			(start.isoformat(' '), width, ip, start.isoformat(' ')[:13], end.isoformat(' ')[:13])).fetchall()
+	finally:
+		db.close()
+	energy_data = []
+	for row in rows:
+		bucket_start = start + timedelta(seconds=max(row[0], 0) * width)
+		# the newest bucket only covers the time up to end
+		hours = max((min(bucket_start + timedelta(seconds=width), end) - bucket_start).total_seconds(), 60) / 3600.0
+		energy_data.append([bucket_start.isoformat(' '), row[1], row[2] * 1000 / hours] + list(row[3:]))
+	return {'energy_data': energy_data, 'bucket_seconds': width}
+
+
+def get_energy_rollup(db_path, ip, period="daily", limit=31, now=None):
+	"""
+	Newest first hourly or daily rollup rows for a plug as
+	``[period, energy (kWh), peak power, average power, samples, last grandtotal]``.
+
+	Average power is the energy used over the period, for the current
+	period over the part of it that has passed at ``now``.
+	"""
+	table, prefix, hours = ROLLUPS[0] if period == "hourly" else ROLLUPS[1]
+	if now is None:
+		now = datetime.today()
+	current = now.isoformat(' ')[:prefix]
+	elapsed = (now - datetime.strptime(current, "%Y-%m-%d %H" if period == "hourly" else "%Y-%m-%d")).total_seconds()
+	db = sqlite3.connect(db_path)
+	try:
+		rows = db.execute(
+			'''SELECT period, energy, peak_power, avg_power, samples, last_grandtotal FROM %s
+				WHERE ip=? ORDER BY period DESC LIMIT ?''' % table, (ip, limit)).fetchall()
+	finally:
+		db.close()
+	rows = [list(row) for row in rows]
+	for row in rows:
+		# derived on read as well, rollups written before averages were energy based still hold sample means
+		row[3] = row[1] * 1000 / (max(elapsed, 60) / 3600.0 if row[0] == current else hours)
+	return {'energy_rollup': rows, 'period': period}
@@ -0,0 +1,147 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import threading
+import time
+
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# upper bounds in seconds, wide enough for both hook calls and device timeouts
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram(object):
+
+	def __init__(self, buckets):
+		self.buckets = buckets
+		self.counts = [0] * (len(buckets) + 1)
+		self.count = 0
+		self.sum = 0.0
+
+	def observe(self, value):
+		self.counts[bisect_left(self.buckets, value)] += 1
+		self.count += 1
+		self.sum += value
+
+	def snapshot(self):
+		cumulative, buckets = 0, []
+		for bound, count in zip(list(self.buckets) + ["+Inf"], self.counts):
+			cumulative += count
+			buckets.append([bound, cumulative])
+		return dict(count=self.count, sum=self.sum, avg=self.sum / self.count if self.count else 0, buckets=buckets)
+
+
+class HookTimer(object):
+	"""
+	Call count and total time of one printer hook.
+
+	Plain attribute updates without a lock, cheap enough for hooks that run
+	for every queued line. Only the thread running the hook writes them,
+	``Metrics.merge_hook`` copies the values when metrics are read.
+	"""
+
+	def __init__(self):
+		self.calls = 0
+		self.seconds = 0.0
+
+	def add(self, seconds):
+		self.calls += 1
+		self.seconds += seconds
+
+	def snapshot(self):
+		calls, seconds = self.calls, self.seconds
+		return dict(calls=calls, seconds=seconds, avg=seconds / calls if calls else 0)
+
+
+class Metrics(object):
+	"""
+	Thread safe counters, gauges and latency histograms with optional labels.
+
+	``snapshot`` returns everything as JSON serializable lists and
+	``prometheus`` renders the Prometheus text exposition format with every
+	name prefixed by ``prefix``.
+	"""
+
+	def __init__(self, prefix="octoprint_tplinksmartplug", buckets=DEFAULT_BUCKETS):
+		self.prefix = prefix
+		self.buckets = buckets
+		self._lock = threading.Lock()
+		self._counters = {}
+		self._gauges = {}
+		self._histograms = {}
+
+	def inc(self, name, value=1, **labels):
+		key = (name, tuple(sorted(labels.items())))
+		with self._lock:
+			self._counters[key] = self._counters.get(key, 0) + value
+
+	def set(self, name, value, **labels):
+		with self._lock:
+			self._gauges[(name, tuple(sorted(labels.items())))] = value
+
+	def merge_hook(self, hook, timer):
+		snapshot = timer.snapshot()
+		with self._lock:
+			self._counters[("hook_calls_total", (("hook", hook),))] = snapshot["calls"]
+			self._counters[("hook_seconds_total", (("hook", hook),))] = snapshot["seconds"]
+
+	def observe(self, name, seconds, **labels):
+		key = (name, tuple(sorted(labels.items())))
+		with self._lock:
+			histogram = self._histograms.get(key)
+			if histogram is None:
+				histogram = self._histograms[key] = Histogram(self.buckets)
+			histogram.observe(seconds)
+
+	@contextmanager
+	def timed(self, name, **labels):
+		start = time.time()
+		try:
+			yield
+		finally:
+			self.observe(name, time.time() - start, **labels)
+
+	def histogram(self, name, **labels):
+		with self._lock:
+			histogram = self._histograms.get((name, tuple(sorted(labels.items()))))
+			return histogram.snapshot() if histogram is not None else Histogram(self.buckets).snapshot()
+
+	def snapshot(self):
+		with self._lock:
+			return dict(
+				counters=[dict(name=name, labels=dict(labels), value=value)
+						  for (name, labels), value in sorted(self._counters.items())],
+				gauges=[dict(name=name, labels=dict(labels), value=value)
+						for (name, labels), value in sorted(self._gauges.items())],
+				histograms=[dict(name=name, labels=dict(labels), **histogram.snapshot())
+							for (name, labels), histogram in sorted(self._histograms.items(), key=lambda item: item[0])])
+
+	def prometheus(self):
+		snapshot = self.snapshot()
+		lines = []
+		for kind, entries in (("counter", snapshot["counters"]), ("gauge", snapshot["gauges"])):
+			for name in sorted(set(entry["name"] for entry in entries)):
+				lines.append("# TYPE %s_%s %s" % (self.prefix, name, kind))
+				for entry in entries:
+					if entry["name"] == name:
+						lines.append("%s_%s%s %s" % (self.prefix, name, self._labels(entry["labels"]), entry["value"]))
+		histograms = snapshot["histograms"]
+		for name in sorted(set(entry["name"] for entry in histograms)):
+			lines.append("# TYPE %s_%s histogram" % (self.prefix, name))
+			for entry in histograms:
+				if entry["name"] != name:
+					continue
+				for bound, count in entry["buckets"]:
+					labels = dict(entry["labels"], le=bound)
+					lines.append("%s_%s_bucket%s %s" % (self.prefix, name, self._labels(labels), count))
+				lines.append("%s_%s_sum%s %s" % (self.prefix, name, self._labels(entry["labels"]), entry["sum"]))
+				lines.append("%s_%s_count%s %s" % (self.prefix, name, self._labels(entry["labels"]), entry["count"]))
+		return "\n".join(lines) + "\n"
+
+	@staticmethod
+	def _labels(labels):
+		if not labels:
+			return ""
+		return "{%s}" % ",".join('%s="%s"' % (key, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+								 for key, value in sorted(labels.items()))
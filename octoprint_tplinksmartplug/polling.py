@@ -0,0 +1,70 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import threading
+
+
+class AdaptivePolling(object):
+	"""
+	Picks the delay until the next status poll of every plug from its latest status.
+
+	A plug is polled every ``fast`` seconds while it is on during a print or
+	while its power draw changes by more than ``change_ratio`` (and at least
+	``min_change`` watts) between polls. Steady plugs back off by ``backoff``
+	per poll up to ``slow`` seconds, plugs that are off are polled every
+	``slow`` seconds and unreachable plugs back off exponentially from
+	``fast`` up to ``slow``.
+	"""
+
+	def __init__(self, backoff=2.0, change_ratio=0.1, min_change=2.0):
+		self.backoff = backoff
+		self.change_ratio = change_ratio
+		self.min_change = min_change
+		self._lock = threading.Lock()
+		self._plugs = {}
+
+	def next_interval(self, plugip, status, fast, slow, printing=False):
+		slow = max(slow, fast)
+		with self._lock:
+			state = self._plugs.setdefault(plugip, dict(interval=fast, failures=0, power=None, reason="initial"))
+			current_state = status.get("currentState") if status else None
+			if current_state not in ("on", "off"):
+				state["failures"] += 1
+				state["power"] = None
+				interval, reason = min(fast * self.backoff ** state["failures"], slow), "unreachable"
+			else:
+				state["failures"] = 0
+				power = self._power(status)
+				last_power = state["power"]
+				state["power"] = power
+				if current_state == "off":
+					interval, reason = slow, "off"
+				elif printing:
+					interval, reason = fast, "printing"
+				elif power is not None and last_power is not None and \
+						abs(power - last_power) > max(self.min_change, abs(last_power) * self.change_ratio):
+					interval, reason = fast, "changing"
+				else:
+					interval, reason = min(state["interval"] * self.backoff, slow), "steady"
+			state["interval"] = interval
+			state["reason"] = reason
+			return interval
+
+	def reset(self, plugip=None):
+		with self._lock:
+			if plugip is None:
+				self._plugs.clear()
+			else:
+				self._plugs.pop(plugip, None)
+
+	def stats(self):
+		with self._lock:
+			return dict((plugip, dict(interval=state["interval"], failures=state["failures"], reason=state["reason"]))
+						for plugip, state in self._plugs.items())
+
+	@staticmethod
+	def _power(status):
+		realtime = (status.get("emeter") or {}).get("get_realtime") or {}
+		if "power_mw" in realtime:
+			return realtime["power_mw"] / 1000.0
+		return realtime.get("power")
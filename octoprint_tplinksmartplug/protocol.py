@@ -0,0 +1,372 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import logging
+import operator
+import select
+import socket
+import threading
+import time
+
+from struct import pack, unpack
+
+try:
+	from itertools import accumulate
+except ImportError:
+	accumulate = None
+
+KASA_PORT = 9999
+KASA_KEY = 171
+MAX_FRAME_SIZE = 1024 * 1024
+
+# the autokey cipher only needs C level loops when itertools.accumulate and int.from_bytes are available
+_fast_codec = accumulate is not None and hasattr(int, "from_bytes")
+
+
+def encode_payload(payload):
+	"""
+	Apply the autokey XOR cipher to ``payload`` (bytes), each output byte becomes the key for the next.
+	"""
+	if _fast_codec:
+		return bytes(bytearray(accumulate(bytearray([KASA_KEY]) + bytearray(payload), operator.xor))[1:])
+	result = bytearray(payload)
+	key = KASA_KEY
+	for i in range(len(result)):
+		key ^= result[i]
+		result[i] = key
+	return bytes(result)
+
+
+def decode_payload(payload):
+	"""
+	Reverse the autokey XOR cipher on ``payload`` (bytes, bytearray or memoryview), each input byte is the key for the next.
+	"""
+	length = len(payload)
+	if length == 0:
+		return b""
+	if _fast_codec:
+		shifted = bytearray([KASA_KEY]) + payload[:-1]
+		return (int.from_bytes(payload, "big") ^ int.from_bytes(shifted, "big")).to_bytes(length, "big")
+	result = bytearray(payload)
+	key = KASA_KEY
+	for i in range(length):
+		key, result[i] = result[i], key ^ result[i]
+	return bytes(result)
+
+
+def encrypt(string):
+	payload = string.encode('latin-1')
+	return pack('>I', len(payload)) + encode_payload(payload)
+
+
+def decrypt(data):
+	return decode_payload(data).decode('latin-1')
+
+
+class HostResolver(object):
+	"""
+	Cache of hostname lookups with a ``ttl`` for answers and a ``negative_ttl`` for failures.
+
+	Entries older than ``refresh_after`` of their ttl are still served but
+	refreshed in a background thread, so callers only wait on the very first
+	lookup of a host or after ``invalidate``.
+	"""
+
+	def __init__(self, ttl=300, negative_ttl=30, refresh_after=0.8, logger=None):
+		self.ttl = ttl
+		self.negative_ttl = negative_ttl
+		self.refresh_after = refresh_after
+		self._logger = logger or logging.getLogger("octoprint.plugins.tplinksmartplug.debug")
+		self._lock = threading.Lock()
+		self._cache = {}
+		self._refreshing = set()
+		self.hits = 0
+		self.misses = 0
+		self.negative_hits = 0
+		self.refreshes = 0
+		self.failures = 0
+
+	def resolve(self, host):
+		now = time.time()
+		with self._lock:
+			entry = self._cache.get(host)
+			if entry is not None and now < entry[1]:
+				ip, expires, refresh_at = entry
+				if ip is None:
+					self.negative_hits += 1
+					return None
+				self.hits += 1
+				if now >= refresh_at and host not in self._refreshing:
+					self._refreshing.add(host)
+					refresher = threading.Thread(target=self._refresh, args=(host,))
+					refresher.daemon = True
+					refresher.start()
+				return ip
+			self.misses += 1
+		return self._lookup(host)
+
+	def invalidate(self, host):
+		with self._lock:
+			self._cache.pop(host, None)
+
+	def stats(self):
+		with self._lock:
+			return dict(hits=self.hits, misses=self.misses, negative_hits=self.negative_hits,
+						refreshes=self.refreshes, failures=self.failures, cached=len(self._cache))
+
+	def _refresh(self, host):
+		try:
+			self._lookup(host, keep_stale=True)
+			with self._lock:
+				self.refreshes += 1
+		finally:
+			with self._lock:
+				self._refreshing.discard(host)
+
+	def _lookup(self, host, keep_stale=False):
+		try:
+			ip = socket.gethostbyname(host)
+		except (socket.herror, socket.gaierror):
+			ip = None
+		now = time.time()
+		with self._lock:
+			if ip is None:
+				self.failures += 1
+				if keep_stale and host in self._cache:
+					# a failed background refresh keeps serving the last good answer until it expires
+					return self._cache[host][0]
+				self._cache[host] = (None, now + self.negative_ttl, now + self.negative_ttl)
+			else:
+				self._cache[host] = (ip, now + self.ttl, now + self.ttl * self.refresh_after)
+		return ip
+
+
+class RequestCancelled(socket.error):
+	pass
+
+
+class KasaConnectionPool(object):
+	"""
+	Keep-alive TCP connections to Kasa devices, keyed by resolved ip address.
+
+	Idle sockets are reused for the next request to the same device, checked
+	for a remote close before reuse and evicted after ``idle_timeout`` seconds.
+	A request on a reused socket that fails with a broken pipe or reset is
+	transparently retried once on a fresh connection.
+
+	Responses are returned as the undecoded payload without its length header.
+	Every request is bounded by ``connect_timeout`` and ``read_timeout``, at
+	most ``max_in_flight`` requests talk to devices at the same time and
+	in-flight requests can be aborted with ``cancel``.
+	"""
+
+	def __init__(self, port=KASA_PORT, idle_timeout=60, connect_timeout=3, read_timeout=5, max_in_flight=16,
+				 logger=None):
+		self.port = port
+		self.idle_timeout = idle_timeout
+		self.connect_timeout = connect_timeout
+		self.read_timeout = read_timeout
+		self._logger = logger or logging.getLogger("octoprint.plugins.tplinksmartplug.debug")
+		self._lock = threading.Lock()
+		self._in_flight = threading.BoundedSemaphore(max_in_flight)
+		self._idle = {}
+		self._active = {}
+		self._cancelled = set()
+
+	def request(self, ip, payload):
+		with self._in_flight:
+			sock, reused = self._acquire(ip)
+			try:
+				data = self._exchange(ip, sock, payload)
+			except (socket.timeout, RequestCancelled):
+				self._close(sock)
+				raise
+			except socket.error:
+				self._close(sock)
+				if not reused:
+					raise
+				self._logger.debug("Pooled connection to %s was broken, reconnecting." % ip)
+				sock = self._connect(ip)
+				try:
+					data = self._exchange(ip, sock, payload)
+				except socket.error:
+					self._close(sock)
+					raise
+			self._release(ip, sock)
+			return data
+
+	def cancel(self, ip=None):
+		with self._lock:
+			socks = [sock for sock, sock_ip in self._active.items() if ip is None or sock_ip == ip]
+			self._cancelled.update(socks)
+		for sock in socks:
+			try:
+				sock.shutdown(socket.SHUT_RDWR)
+			except socket.error:
+				pass
+
+	def evict_idle(self):
+		now = time.time()
+		expired = []
+		with self._lock:
+			for ip in list(self._idle):
+				keep = []
+				for sock, last_used in self._idle[ip]:
+					if now - last_used > self.idle_timeout:
+						expired.append(sock)
+					else:
+						keep.append((sock, last_used))
+				if keep:
+					self._idle[ip] = keep
+				else:
+					del self._idle[ip]
+		for sock in expired:
+			self._close(sock)
+
+	def discard(self, ip):
+		with self._lock:
+			entries = self._idle.pop(ip, [])
+		for sock, last_used in entries:
+			self._close(sock)
+
+	def close_all(self):
+		with self._lock:
+			entries = [entry for ip_entries in self._idle.values() for entry in ip_entries]
+			self._idle = {}
+		for sock, last_used in entries:
+			self._close(sock)
+
+	def _acquire(self, ip):
+		self.evict_idle()
+		while True:
+			with self._lock:
+				entries = self._idle.get(ip)
+				if not entries:
+					break
+				sock, last_used = entries.pop()
+			if self._is_healthy(sock):
+				return sock, True
+			self._close(sock)
+		return self._connect(ip), False
+
+	def _release(self, ip, sock):
+		with self._lock:
+			self._idle.setdefault(ip, []).append((sock, time.time()))
+
+	def _connect(self, ip):
+		sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+		sock.settimeout(self.connect_timeout)
+		try:
+			sock.connect((ip, self.port))
+		except socket.error:
+			self._close(sock)
+			raise
+		return sock
+
+	def _is_healthy(self, sock):
+		# an idle socket should have nothing to read, readable means closed by the device or stray data
+		try:
+			readable, _, errored = select.select([sock], [], [sock], 0)
+		except (socket.error, ValueError, select.error):
+			return False
+		return not readable and not errored
+
+	def _exchange(self, ip, sock, payload):
+		with self._lock:
+			self._active[sock] = ip
+		try:
+			deadline = time.time() + self.read_timeout
+			sock.settimeout(self.read_timeout)
+			sock.sendall(payload)
+			header = bytearray(4)
+			self._recv_into(sock, memoryview(header), deadline)
+			length = unpack('>I', bytes(header))[0]
+			if length > MAX_FRAME_SIZE:
+				raise socket.error("Invalid frame length %s from device." % length)
+			data = bytearray(length)
+			self._recv_into(sock, memoryview(data), deadline)
+			return data
+		except socket.error:
+			if self._pop_cancelled(sock):
+				raise RequestCancelled("Request to %s was cancelled." % ip)
+			raise
+		finally:
+			with self._lock:
+				self._active.pop(sock, None)
+				self._cancelled.discard(sock)
+
+	def _recv_into(self, sock, view, deadline):
+		# fill the whole view, the frame (or even its header) may arrive split over several reads
+		received = 0
+		while received < len(view):
+			remaining = deadline - time.time()
+			if remaining <= 0:
+				raise socket.timeout("Timed out waiting for device response.")
+			sock.settimeout(remaining)
+			count = sock.recv_into(view[received:])
+			if not count:
+				raise socket.error("Connection closed by device.")
+			received += count
+
+	def _pop_cancelled(self, sock):
+		with self._lock:
+			if sock in self._cancelled:
+				self._cancelled.discard(sock)
+				return True
+			return False
+
+	def _close(self, sock):
+		try:
+			sock.close()
+		except socket.error:
+			pass
+
+
+def merge_commands(cmds):
+	"""
+	Merge several command dicts into one request so their modules share a single round trip.
+	Example:
+		merge_commands([{"system": {"get_sysinfo": {}}}, {"emeter": {"get_realtime": {}}}])
+		# => {"system": {"get_sysinfo": {}}, "emeter": {"get_realtime": {}}}
+	"""
+	merged = {}
+	for cmd in cmds:
+		for module, methods in cmd.items():
+			if isinstance(methods, dict):
+				merged.setdefault(module, {}).update(methods)
+			else:
+				merged[module] = methods
+	return merged
+
+
+def split_response(response, cmds):
+	"""
+	Split the response of a merged request back into one response per original command.
+	"""
+	return [dict((module, response.get(module) or {}) for module in cmd if module != "context") for cmd in cmds]
+
+
+def udp_sweep(payload, address="255.255.255.255", port=KASA_PORT, deadline=1.0):
+	"""
+	Send ``payload`` (a JSON string) as one UDP datagram to ``address`` and collect the replies.
+
+	Kasa devices answer on UDP with the same cipher as TCP but without the
+	length header. ``address`` may be a broadcast or a unicast address.
+	Returns the decrypted replies that arrived within ``deadline`` seconds,
+	keyed by the ip address they came from.
+	"""
+	sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+	try:
+		sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+		sock.sendto(encode_payload(payload.encode('latin-1')), (address, port))
+		replies = {}
+		end = time.time() + deadline
+		while True:
+			remaining = end - time.time()
+			if remaining <= 0 or not select.select([sock], [], [], remaining)[0]:
+				break
+			data, sender = sock.recvfrom(65535)
+			replies[sender[0]] = decrypt(data)
+		return replies
+	finally:
+		sock.close()
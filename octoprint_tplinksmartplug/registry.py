@@ -0,0 +1,75 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import threading
+
+
+def parse_plugip(plugip):
+	"""
+	Split a configured plug address into host and 1 based child index, 0 for single outlet plugs.
+	Example:
+		parse_plugip("192.168.0.2/3")  # => ("192.168.0.2", 3)
+		parse_plugip("192.168.0.2")    # => ("192.168.0.2", 0)
+	"""
+	plugip = plugip.strip()
+	if "/" in plugip:
+		host, child = plugip.split("/", 1)
+		return host, int(child)
+	return plugip, 0
+
+
+class PlugRecord(dict):
+	"""
+	A configured plug, its settings are available as dict items like the plain settings entries.
+	"""
+
+	def __init__(self, settings):
+		dict.__init__(self, settings)
+		self.ip = self.get("ip", "").strip()
+		try:
+			self.host, self.child = parse_plugip(self.ip)
+		except ValueError:
+			self.host, self.child = self.ip, 0
+
+
+class PlugRegistry(object):
+	"""
+	In-memory index of the configured plugs by ip and label.
+
+	Built from ``arrSmartplugs`` with ``rebuild`` whenever settings change, so
+	lookups on hot paths never touch the settings structure. A rebuild swaps
+	in complete new indexes, readers never see a partially built registry.
+	"""
+
+	def __init__(self):
+		self._lock = threading.Lock()
+		self._plugs = []
+		self._by_ip = {}
+		self._by_label = {}
+
+	def rebuild(self, plugs):
+		with self._lock:
+			records = [PlugRecord(plug) for plug in plugs]
+			self._by_ip = dict((record.ip, record) for record in records if record.ip)
+			self._by_label = dict((record.get("label"), record) for record in records if record.get("label"))
+			self._plugs = records
+
+	def get(self, plugip):
+		if plugip is None:
+			return None
+		return self._by_ip.get(plugip.strip())
+
+	def get_by_label(self, label):
+		return self._by_label.get(label)
+
+	def find(self, value):
+		# gcode commands may reference a plug by ip or by label
+		if value is None:
+			return None
+		return self.get(value) or self.get_by_label(value.strip())
+
+	def __iter__(self):
+		return iter(self._plugs)
+
+	def __len__(self):
+		return len(self._plugs)
@@ -0,0 +1,82 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import threading
+
+from array import array
+
+NAN = float("nan")
+
+
+class SampleRing(object):
+	"""
+	Fixed size ring buffer of emeter samples for one plug.
+
+	Every field is a preallocated ``array('d')`` column, so appending a
+	sample never allocates and the buffer holds the last ``capacity``
+	samples. Missing readings are stored as NaN and returned as None.
+	Samples are ``(timestamp, current, power, voltage, total)`` tuples with
+	timestamps in seconds since the epoch.
+	"""
+
+	def __init__(self, capacity=3600):
+		self.capacity = capacity
+		self._columns = [array('d', [0.0]) * capacity for _ in range(5)]
+		self._next = 0
+		self._count = 0
+		self._lock = threading.Lock()
+
+	def __len__(self):
+		return self._count
+
+	def append(self, timestamp, current, power, voltage, total):
+		with self._lock:
+			for column, value in zip(self._columns, (timestamp, current, power, voltage, total)):
+				column[self._next] = NAN if value is None or value == "" else value
+			self._next = (self._next + 1) % self.capacity
+			self._count = min(self._count + 1, self.capacity)
+
+	def latest(self):
+		with self._lock:
+			if not self._count:
+				return None
+			return self._sample((self._next - 1) % self.capacity)
+
+	def since(self, timestamp):
+		"""
+		Samples newer than ``timestamp``, oldest first.
+		"""
+		with self._lock:
+			samples = []
+			for offset in range(1, self._count + 1):
+				index = (self._next - offset) % self.capacity
+				if self._columns[0][index] <= timestamp:
+					break
+				samples.append(self._sample(index))
+		samples.reverse()
+		return samples
+
+	def summarize(self, start, end):
+		"""
+		Average current, power and voltage plus the last total of the samples in ``[start, end)``, None without samples.
+		"""
+		with self._lock:
+			samples = []
+			for offset in range(1, self._count + 1):
+				index = (self._next - offset) % self.capacity
+				if self._columns[0][index] < start:
+					break
+				if self._columns[0][index] < end:
+					samples.append(self._sample(index))
+		samples.reverse()
+		if not samples:
+			return None
+		averages = []
+		for field in (1, 2, 3):
+			values = [sample[field] for sample in samples if sample[field] is not None]
+			averages.append(sum(values) / len(values) if values else None)
+		current, power, voltage = averages
+		return samples[-1][0], current, power, voltage, samples[-1][4]
+
+	def _sample(self, index):
+		return tuple(None if value != value else value for value in (column[index] for column in self._columns))
@@ -0,0 +1,172 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+try:
+	import queue
+except ImportError:
+	import Queue as queue
+
+monotonic_time = getattr(time, "monotonic", time.time)
+
+
+class ScheduledAction(object):
+	"""
+	Handle of an action queued on an ``ActionScheduler``, ``cancel`` removes it if it has not started yet.
+	"""
+
+	def __init__(self, scheduler, when, func, args, kwargs, key, interval, blocking=False):
+		self._scheduler = scheduler
+		self.when = when
+		self.func = func
+		self.args = args
+		self.kwargs = kwargs
+		self.key = key
+		self.interval = interval
+		self.blocking = blocking
+		self.cancelled = False
+
+	def cancel(self):
+		self._scheduler._cancel_action(self)
+
+	@property
+	def name(self):
+		return getattr(self.func, "__name__", repr(self.func))
+
+
+class ActionScheduler(object):
+	"""
+	Single timer thread for every delayed and repeating plugin action.
+
+	Actions wait in a heap ordered by due time and are handed to a fixed pool
+	of ``workers`` threads when due, so the thread count stays constant no
+	matter how many actions are pending. Actions scheduled with ``blocking``
+	(device I/O, user commands, waits for heaters) go to a second fixed pool
+	of ``blocking_workers`` threads instead, so they never hold up the short
+	actions. Scheduling an action with the
+	``key`` of a pending one replaces it, which gives per plug and action
+	debouncing. Repeating actions are rescheduled ``interval`` seconds after
+	each run finishes, so a slow run never overlaps the next one.
+	"""
+
+	def __init__(self, workers=4, blocking_workers=8, logger=None):
+		self.workers = workers
+		self.blocking_workers = blocking_workers
+		self._logger = logger or logging.getLogger("octoprint.plugins.tplinksmartplug.debug")
+		self._condition = threading.Condition()
+		self._heap = []
+		self._keys = {}
+		self._sequence = itertools.count()
+		self._tasks = queue.Queue()
+		self._blocking_tasks = queue.Queue()
+		self._threads = []
+		self._running = False
+
+	def start(self):
+		with self._condition:
+			if self._running:
+				return
+			self._running = True
+		self._threads = [threading.Thread(target=self._run)]
+		self._threads += [threading.Thread(target=self._work, args=(self._tasks,)) for _ in range(self.workers)]
+		self._threads += [threading.Thread(target=self._work, args=(self._blocking_tasks,))
+						  for _ in range(self.blocking_workers)]
+		for thread in self._threads:
+			thread.daemon = True
+			thread.start()
+
+	def stop(self):
+		with self._condition:
+			self._running = False
+			self._condition.notify()
+		for _ in range(self.workers):
+			self._tasks.put(None)
+		for _ in range(self.blocking_workers):
+			self._blocking_tasks.put(None)
+		self._threads = []
+
+	def schedule(self, delay, func, args=None, kwargs=None, key=None, interval=None, blocking=False):
+		action = ScheduledAction(self, monotonic_time() + max(delay, 0), func, args or [], kwargs or {}, key, interval,
+								 blocking)
+		with self._condition:
+			if key is not None:
+				previous = self._keys.get(key)
+				if previous is not None:
+					previous.cancelled = True
+				self._keys[key] = action
+			heapq.heappush(self._heap, (action.when, next(self._sequence), action))
+			self._condition.notify()
+		return action
+
+	def schedule_repeating(self, interval, func, args=None, kwargs=None, key=None, delay=None, blocking=False):
+		return self.schedule(interval if delay is None else delay, func, args=args, kwargs=kwargs, key=key,
+							 interval=interval, blocking=blocking)
+
+	def cancel(self, key):
+		with self._condition:
+			action = self._keys.pop(key, None)
+			if action is not None:
+				action.cancelled = True
+		return action is not None
+
+	def is_pending(self, key):
+		with self._condition:
+			return key in self._keys
+
+	def pending(self):
+		now = monotonic_time()
+		with self._condition:
+			actions = sorted((entry[2] for entry in self._heap if not entry[2].cancelled), key=lambda action: action.when)
+		return [dict(key=action.key if action.key is None or isinstance(action.key, str) else list(action.key),
+					 action=action.name, due_in=round(action.when - now, 3), interval=action.interval,
+					 blocking=action.blocking)
+				for action in actions]
+
+	def _cancel_action(self, action):
+		with self._condition:
+			action.cancelled = True
+			if action.key is not None and self._keys.get(action.key) is action:
+				del self._keys[action.key]
+
+	def _run(self):
+		with self._condition:
+			while self._running:
+				while self._heap and self._heap[0][2].cancelled:
+					heapq.heappop(self._heap)
+				if not self._heap:
+					self._condition.wait()
+					continue
+				delay = self._heap[0][0] - monotonic_time()
+				if delay > 0:
+					self._condition.wait(delay)
+					continue
+				action = heapq.heappop(self._heap)[2]
+				if action.interval is None and action.key is not None and self._keys.get(action.key) is action:
+					del self._keys[action.key]
+				(self._blocking_tasks if action.blocking else self._tasks).put(action)
+
+	def _work(self, tasks):
+		while True:
+			action = tasks.get()
+			if action is None:
+				return
+			self._execute(action)
+
+	def _execute(self, action):
+		if action.cancelled:
+			return
+		try:
+			action.func(*action.args, **action.kwargs)
+		except Exception:
+			self._logger.exception("Scheduled action %s failed." % action.name)
+		if action.interval is not None:
+			with self._condition:
+				if not action.cancelled and self._running:
+					action.when = monotonic_time() + action.interval
+					heapq.heappush(self._heap, (action.when, next(self._sequence), action))
+					self._condition.notify()
@@ -33,6 +33,14 @@ $(function() {
 		self.plotted_graph_ip = ko.observable(false);
 		self.plotted_graph_records = ko.observable(10);
 		self.plotted_graph_records_offset = ko.observable(0);
+		self.plotted_graph_range = ko.observable(0);
+		self.plotted_graph_buckets = 500;
+		self.plotted_graph_live = false;
+		self.graph_ranges = [{label: gettext('Records'), value: 0},
+							{label: gettext('Last Day'), value: 86400},
+							{label: gettext('Last Week'), value: 604800},
+							{label: gettext('Last Month'), value: 2592000},
+							{label: gettext('Last Year'), value: 31536000}];
 		self.dictSmartplugs = ko.observableDictionary();
 		self.refreshVisible = ko.observable(true);
 		self.powerOffWhenIdle = ko.observable(false);
@@ -190,6 +198,7 @@ $(function() {
 			self.plotted_graph_ip.subscribe(self.plotEnergyData, self);
 			self.plotted_graph_records.subscribe(self.plotEnergyData, self);
 			self.plotted_graph_records_offset.subscribe(self.plotEnergyData, self);
+			self.plotted_graph_range.subscribe(self.plotEnergyData, self);
 			self.checkStatuses();
 		}
 
@@ -212,9 +221,40 @@ $(function() {
 		self.onTabChange = function(current, previous) {
 				if (current === "#tab_plugin_tplinksmartplug") {
 					self.plotEnergyData(false);
+					self.startLiveSampling();
+				} else if (previous === "#tab_plugin_tplinksmartplug") {
+					self.stopLiveSampling();
 				}
 			};
 
+		self.live_sampling_timer = null;
+
+		self.requestLiveSampling = function() {
+			$.ajax({
+				url: API_BASEURL + "plugin/tplinksmartplug",
+				type: "POST",
+				dataType: "json",
+				data: JSON.stringify({command: "liveSampling"}),
+				contentType: "application/json; charset=UTF-8"
+			});
+		}
+
+		// the server samples for 30 seconds per request, renew while the tab stays open
+		self.startLiveSampling = function() {
+			if(!self.settings.settings.plugins.tplinksmartplug.live_sampling() || self.live_sampling_timer !== null) {
+				return;
+			}
+			self.requestLiveSampling();
+			self.live_sampling_timer = setInterval(self.requestLiveSampling, 20000);
+		}
+
+		self.stopLiveSampling = function() {
+			if(self.live_sampling_timer !== null) {
+				clearInterval(self.live_sampling_timer);
+				self.live_sampling_timer = null;
+			}
+		}
+
 		self.cancelClick = function(data) {
 			self.processing.remove(data.ip());
 		}
@@ -259,7 +299,9 @@ $(function() {
 								'gcodeCmdOn': ko.observable(false),
 								'gcodeCmdOff': ko.observable(false),
 								'gcodeRunCmdOn': ko.observable(''),
-								'gcodeRunCmdOff': ko.observable('')
+								'gcodeRunCmdOff': ko.observable(''),
+								'pollingFastInterval': ko.observable(10),
+								'pollingSlowInterval': ko.observable(0)
 			});
 			self.settings.settings.plugins.tplinksmartplug.arrSmartplugs.push(self.selectedPlug());
 			$("#TPLinkPlugEditor").modal("show");
@@ -282,8 +324,12 @@ $(function() {
 				self.checkStatus(data.ip);
 			}
 
-			if(data.updatePlot && window.location.href.indexOf('tplinksmartplug') > 0){
-				self.plotEnergyData();
+			if(data.energyData && data.energyData.ip == self.plotted_graph_ip() && window.location.href.indexOf('tplinksmartplug') > 0){
+				self.appendEnergyData(data.energyData.rows);
+			}
+
+			if(data.liveSamples && data.liveSamples[self.plotted_graph_ip()] && window.location.href.indexOf('tplinksmartplug') > 0){
+				self.appendEnergyData([data.liveSamples[self.plotted_graph_ip()]]);
 			}
 
 			if(data.hasOwnProperty("powerOffWhenIdle")) {
@@ -370,16 +416,21 @@ $(function() {
 
 		self.plotEnergyData = function(data) {
 			if(self.plotted_graph_ip()) {
+				var request = {command: "getEnergyData", ip: self.plotted_graph_ip()};
+				self.plotted_graph_live = false;
+				if(self.plotted_graph_range() > 0) {
+					// server side downsampled buckets keep the response size flat for long ranges
+					request.buckets = self.plotted_graph_buckets;
+					request.range_seconds = self.plotted_graph_range();
+				} else {
+					request.record_limit = self.plotted_graph_records();
+					request.record_offset = self.plotted_graph_records_offset();
+				}
 				$.ajax({
 				url: API_BASEURL + "plugin/tplinksmartplug",
 				type: "POST",
 				dataType: "json",
-				data: JSON.stringify({
-					command: "getEnergyData",
-					ip: self.plotted_graph_ip(),
-					record_limit: self.plotted_graph_records(),
-					record_offset: self.plotted_graph_records_offset()
-				}),
+				data: JSON.stringify(request),
 				cost_rate: self.settings.settings.plugins.tplinksmartplug.cost_rate(),
 				contentType: "application/json; charset=UTF-8"
 				}).done(function(data){
@@ -388,7 +439,8 @@ $(function() {
 						var trace_total = {x:[],y:[],mode:'lines+markers',name:'Total (kWh)'};
 						var trace_cost = {x:[],y:[],mode:'lines+markers',name:'Cost'}
 
-						ko.utils.arrayForEach(data.energy_data, function(row){
+						// rows arrive newest first, traces are kept oldest first so new samples can be appended
+						ko.utils.arrayForEach(data.energy_data.slice().reverse(), function(row){
 							trace_current.x.push(row[0]);
 							trace_current.y.push(row[1]);
 							trace_power.x.push(row[0]);
@@ -474,11 +526,28 @@ $(function() {
 						var plot_data = [trace_total,trace_current,trace_power,trace_cost/* ,trace_voltage */]
 						if(window.location.href.indexOf('tplinksmartplug') > 0){
 							Plotly.react('tplinksmartplug_energy_graph',plot_data,layout,options);
+							// only the newest raw records follow new samples, ranges and offsets are refetched
+							self.plotted_graph_live = (request.ip == self.plotted_graph_ip() && self.plotted_graph_range() == 0 && self.plotted_graph_records_offset() == 0);
 						}
 					});
 			}
 		}
 
+		self.appendEnergyData = function(rows) {
+			if(!self.plotted_graph_live || rows.length == 0) {
+				return;
+			}
+			var x = [], total = [], current = [], power = [], cost = [];
+			ko.utils.arrayForEach(rows, function(row){
+				x.push(row[0]);
+				current.push(row[1]);
+				power.push(row[2]);
+				total.push(row[3]);
+				cost.push((row[3]*self.settings.settings.plugins.tplinksmartplug.cost_rate()).toFixed(3));
+			});
+			Plotly.extendTraces('tplinksmartplug_energy_graph', {x: [x, x, x, x], y: [total, current, power, cost]}, [0, 1, 2, 3], parseInt(self.plotted_graph_records()));
+		}
+
 		self.legend_visible = ko.observable(false);
 
 		self.toggle_legend = function(){
@@ -495,9 +564,6 @@ $(function() {
 							for (key in data.emeter.get_realtime){
 								item.emeter.get_realtime[key] = ko.observable(data.emeter.get_realtime[key]);
 							}
-							if(data.ip == self.plotted_graph_ip() && window.location.href.indexOf('tplinksmartplug') > 0){
-								self.plotEnergyData();
-							}
 						}
 						self.processing.remove(data.ip);
 					}
@@ -0,0 +1,172 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import logging
+import threading
+import time
+
+try:
+	import queue
+except ImportError:
+	import Queue as queue
+
+
+class StatusSweeper(object):
+	"""
+	Bounded pool of worker threads that queries many plugs at once.
+
+	``sweep`` hands every item to the pool, invokes ``callback`` from the
+	worker as soon as an individual result is available and returns the
+	results collected before the sweep deadline. Items still running at the
+	deadline keep going in the background and report through ``callback``
+	when they eventually finish.
+	"""
+
+	def __init__(self, max_workers=8, deadline=10, logger=None):
+		self.max_workers = max_workers
+		self.deadline = deadline
+		self._logger = logger or logging.getLogger("octoprint.plugins.tplinksmartplug.debug")
+		self._tasks = queue.Queue()
+		self._workers = []
+		self._idle_workers = 0
+		self._lock = threading.Lock()
+
+	def sweep(self, items, func, callback=None, deadline=None):
+		items = [item for item in items if item]
+		if deadline is None:
+			deadline = self.deadline
+		results = queue.Queue()
+		for item in items:
+			self._submit((func, item, callback, results))
+
+		collected = {}
+		end = time.time() + deadline
+		while len(collected) < len(items):
+			remaining = end - time.time()
+			if remaining <= 0:
+				break
+			try:
+				item, result = results.get(timeout=remaining)
+			except queue.Empty:
+				break
+			collected[item] = result
+
+		missing = [item for item in items if item not in collected]
+		if missing:
+			self._logger.debug("Status sweep deadline of %ss reached waiting for %s." % (deadline, ", ".join(missing)))
+		return collected
+
+	def shutdown(self):
+		with self._lock:
+			workers = self._workers
+			self._workers = []
+		for _ in workers:
+			self._tasks.put(None)
+
+	def _submit(self, task):
+		with self._lock:
+			if self._idle_workers == 0 and len(self._workers) < self.max_workers:
+				worker = threading.Thread(target=self._work)
+				worker.daemon = True
+				self._workers.append(worker)
+				worker.start()
+			else:
+				self._idle_workers -= 1
+		self._tasks.put(task)
+
+	def _work(self):
+		while True:
+			task = self._tasks.get()
+			if task is None:
+				return
+			func, item, callback, results = task
+			try:
+				result = func(item)
+			except Exception:
+				self._logger.exception("Status check of %s failed." % item)
+				result = None
+			if callback is not None and result is not None:
+				try:
+					callback(result)
+				except Exception:
+					self._logger.exception("Status callback for %s failed." % item)
+			results.put((item, result))
+			with self._lock:
+				self._idle_workers += 1
+
+
+class StatusCache(object):
+	"""
+	Short lived per-plug status cache with single-flight loading.
+
+	``get`` returns a cached status younger than ``ttl`` seconds. Otherwise
+	the first caller runs ``loader`` while concurrent callers for the same
+	plug wait for and share its result instead of querying the device again.
+	``invalidate`` drops the cached status and makes sure a query that was
+	already running when a plug was switched is not cached or shared with
+	later callers.
+	"""
+
+	def __init__(self, ttl=2):
+		self.ttl = ttl
+		self._lock = threading.Lock()
+		self._entries = {}
+		self._in_flight = {}
+		self._hits = 0
+		self._shared = 0
+		self._loads = 0
+
+	def get(self, key, loader):
+		with self._lock:
+			entry = self._entries.get(key)
+			if entry is not None and entry[0] > time.time():
+				self._hits += 1
+				return entry[1]
+			flight = self._in_flight.get(key)
+			leader = flight is None
+			if leader:
+				flight = self._in_flight[key] = _Flight()
+				self._loads += 1
+			else:
+				self._shared += 1
+
+		if not leader:
+			flight.done.wait()
+			if flight.error is not None:
+				raise flight.error
+			return flight.result
+
+		try:
+			flight.result = loader(key)
+		except Exception as e:
+			flight.error = e
+			raise
+		finally:
+			with self._lock:
+				if self._in_flight.get(key) is flight:
+					del self._in_flight[key]
+					if flight.error is None:
+						self._entries[key] = (time.time() + self.ttl, flight.result)
+			flight.done.set()
+		return flight.result
+
+	def invalidate(self, key=None):
+		with self._lock:
+			if key is None:
+				self._entries.clear()
+				self._in_flight.clear()
+			else:
+				self._entries.pop(key, None)
+				self._in_flight.pop(key, None)
+
+	def stats(self):
+		with self._lock:
+			return dict(hits=self._hits, shared=self._shared, loads=self._loads, cached=len(self._entries))
+
+
+class _Flight(object):
+
+	def __init__(self):
+		self.done = threading.Event()
+		self.result = None
+		self.error = None